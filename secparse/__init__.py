@@ -1 +1,2 @@
-from . import config, sec_parse, db, utilities, apis
+from . import config, sec_parse, db, utilities, apis, classify, dates, analytics, watch, panel, edgar_index, shards, \
+    benchmark, resolver, writer
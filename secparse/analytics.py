@@ -0,0 +1,157 @@
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+from .config import *
+from .shards import SHARDED_TABLES
+
+try:
+    import duckdb
+except ImportError:  # optional dependency -- only needed for analytic queries
+    duckdb = None
+
+ANALYTIC_TABLES = [DB_SIC_TABLE, DB_COMPANY_TABLE, DB_FILING_TABLE, DB_FILING_DATA_TABLE]
+
+
+class AnalyticsBackend(object):
+    """
+    Embedded DuckDB engine for aggregate queries over parsed filing data. SQLite remains the store that filings are
+    ingested into -- DuckDB reads it in place (or a Parquet export of it) with vectorised, multi-core scans.
+
+    Tables are exposed under the `edgar` schema whichever source is used. Only committed data is visible.
+    """
+
+    def __init__(self, source=None, threads=ANALYTICS_THREADS, shard_paths=None):
+        """
+        :param source: SQLite database or directory of Parquet files -- defaults to the main database
+        :param shard_paths: year shards (see DB_SHARDED) whose filing tables are read along with the main database --
+        None for an unsharded database
+        """
+        if duckdb is None:
+            raise ImportError('DuckDB is required for analytic queries. Install it with `pip install duckdb`.')
+
+        source = Path(source) if source else DB_FILE_LOC
+
+        self.conn = duckdb.connect()
+
+        if threads:
+            self.conn.execute(f'SET threads TO {int(threads)}')
+
+        if source.is_dir():
+            # directory of Parquet files written by export_parquet
+            self.conn.execute('CREATE SCHEMA edgar')
+            for table in ANALYTIC_TABLES:
+                self.conn.execute(f"CREATE VIEW edgar.{table} AS "
+                                  f"SELECT * FROM read_parquet('{source.joinpath(table + '.parquet')}')")
+        elif shard_paths is not None:
+            if not shard_paths:
+                # a sharded main database has no filing tables of its own to fall back on
+                raise ValueError(f'DB_SHARDED is set but there are no shards in {DB_SHARD_DIR} -- run shard_database '
+                                 f'or update_filings first.')
+
+            # year-sharded layout -- DuckDB has no limit on attached databases, so every shard is unioned
+            self._load_sqlite_extension()
+            self.conn.execute(f"ATTACH '{source}' AS edgar_main (TYPE SQLITE, READ_ONLY)")
+            self.conn.execute('CREATE SCHEMA edgar')
+
+            for i, path in enumerate(shard_paths):
+                self.conn.execute(f"ATTACH '{path}' AS edgar_shard_{i} (TYPE SQLITE, READ_ONLY)")
+
+            for table in ANALYTIC_TABLES:
+                if table in SHARDED_TABLES:
+                    union = ' UNION ALL '.join(f'SELECT * FROM edgar_shard_{i}.{table}'
+                                               for i in range(len(shard_paths)))
+                    self.conn.execute(f'CREATE VIEW edgar.{table} AS {union}')
+                else:
+                    self.conn.execute(f'CREATE VIEW edgar.{table} AS SELECT * FROM edgar_main.{table}')
+        else:
+            self._load_sqlite_extension()
+            self.conn.execute(f"ATTACH '{source}' AS edgar (TYPE SQLITE, READ_ONLY)")
+
+    def _load_sqlite_extension(self):
+        """Loads DuckDB's sqlite extension, downloading it first if it isn't installed -- which needs network access"""
+        try:
+            self.conn.execute('LOAD sqlite')
+            return
+        except duckdb.Error:
+            pass
+
+        try:
+            self.conn.execute('INSTALL sqlite')
+            self.conn.execute('LOAD sqlite')
+        except duckdb.Error as err:
+            raise ImportError("DuckDB's sqlite extension isn't installed and couldn't be downloaded. Install it "
+                              "where there's network access with `python -c \"import duckdb; "
+                              "duckdb.execute('INSTALL sqlite')\"`, then copy ~/.duckdb/extensions to this "
+                              "machine.") from err
+
+    def close(self):
+        self.conn.close()
+
+    def query(self, sql: str, params: Optional[list] = None) -> pd.DataFrame:
+        """Runs arbitrary SQL against the `edgar` schema"""
+        return self.conn.execute(sql, params or []).df()
+
+    def export_parquet(self, out_dir) -> Path:
+        """Writes each table to <out_dir>/<table>.parquet, which can be used as a source in place of the SQLite file"""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        for table in ANALYTIC_TABLES:
+            self.conn.execute(f"COPY (SELECT * FROM edgar.{table}) TO '{out_dir.joinpath(table + '.parquet')}' "
+                              f"(FORMAT PARQUET)")
+
+        return out_dir
+
+    def term_history(self, term: str, ciks: Optional[List[str]] = None,
+                     filing_type: Optional[str] = None) -> pd.DataFrame:
+        """Every stored value of an accounting term, by company and period"""
+        sql = f"""
+            SELECT fi.company_cik, ci.company_name, fd.value_period, fd.filing_type,
+                   TRY_CAST(fd.filing_value AS DOUBLE) AS filing_value, fi.form, fi.filing_accession
+            FROM edgar.{DB_FILING_DATA_TABLE} fd
+            JOIN edgar.{DB_FILING_TABLE} fi ON fi.filing_accession = fd.filing_accession
+            LEFT JOIN edgar.{DB_COMPANY_TABLE} ci ON ci.company_cik = fi.company_cik
+            WHERE fd.filing_term = ?
+        """
+        params = [term]
+
+        if ciks:
+            sql += ' AND list_contains(?, fi.company_cik)'
+            params.append([str(cik) for cik in ciks])
+
+        if filing_type:
+            sql += ' AND fd.filing_type = ?'
+            params.append(filing_type)
+
+        return self.query(sql + ' ORDER BY fi.company_cik, fd.value_period', params)
+
+    def sic_term_medians(self, term: str, filing_type: Optional[str] = None, period_from: Optional[int] = None,
+                         period_to: Optional[int] = None) -> pd.DataFrame:
+        """Cross-sectional median of an accounting term per SIC code and period (periods as %Y%m%d integers)"""
+        sql = f"""
+            SELECT CAST(ci.company_sic AS VARCHAR) AS sic_code, si.industry_title, fd.value_period,
+                   median(TRY_CAST(fd.filing_value AS DOUBLE)) AS median_value,
+                   count(DISTINCT fi.company_cik) AS companies
+            FROM edgar.{DB_FILING_DATA_TABLE} fd
+            JOIN edgar.{DB_FILING_TABLE} fi ON fi.filing_accession = fd.filing_accession
+            JOIN edgar.{DB_COMPANY_TABLE} ci ON ci.company_cik = fi.company_cik
+            LEFT JOIN edgar.{DB_SIC_TABLE} si ON CAST(si.sic_code AS VARCHAR) = CAST(ci.company_sic AS VARCHAR)
+            WHERE fd.filing_term = ? AND ci.company_sic IS NOT NULL
+        """
+        params = [term]
+
+        if filing_type:
+            sql += ' AND fd.filing_type = ?'
+            params.append(filing_type)
+
+        if period_from:
+            sql += ' AND fd.value_period >= ?'
+            params.append(int(period_from))
+
+        if period_to:
+            sql += ' AND fd.value_period <= ?'
+            params.append(int(period_to))
+
+        return self.query(sql + ' GROUP BY 1, 2, 3 ORDER BY 1, 3', params)
@@ -0,0 +1,282 @@
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .config import *
+from .db import EdgarDatabase, CompanyInfo, FilingInfo, FilingData, SicInfo, filing_filters
+
+# a scale factor of 1 is roughly 1,000 companies, 40,000 filings and 6-7M filing_data rows
+BENCHMARK_BASE_COMPANIES = 1000
+BENCHMARK_FILINGS_PER_COMPANY = 40
+BENCHMARK_TERMS_PER_STATEMENT = 40
+BENCHMARK_INSERT_BATCH = 50000
+
+# share of filings by form type, roughly as seen in the XBRL feeds
+_FORM_MIX = {'10-Q': .55, '8-K': .22, '10-K': .18, '10-Q/A': .03, 'S-4': .02}
+
+_CORE_TERMS = ['Total assets', 'Total liabilities', 'Cash and cash equivalents', 'Total current assets',
+               'Total current liabilities', 'Retained earnings', 'Total stockholders equity', 'Revenues', 'Net income',
+               'Operating income', 'Cost of revenue', 'Gross profit', 'Income tax expense', 'Earnings per share basic',
+               'Earnings per share diluted', 'Depreciation and amortization', 'Net cash from operating activities',
+               'Net cash from investing activities', 'Net cash from financing activities', 'Accounts receivable',
+               'Inventories', 'Property plant and equipment net', 'Goodwill', 'Long-term debt', 'Accounts payable']
+_TERM_PREFIXES = ['Accrued', 'Deferred', 'Other', 'Prepaid', 'Current portion of', 'Noncurrent', 'Net', 'Proceeds from',
+                  'Payments for', 'Increase in', 'Decrease in', 'Unrealized']
+_TERM_NOUNS = ['income taxes', 'compensation', 'leases', 'interest', 'revenue', 'expenses', 'investments', 'debt',
+               'receivables', 'liabilities', 'assets', 'dividends', 'warrants', 'derivatives', 'restructuring',
+               'acquisitions', 'borrowings', 'royalties', 'contingencies', 'pension obligations']
+_NAME_WORDS = ['Apex', 'Summit', 'Blue', 'River', 'Granite', 'Pacific', 'Atlas', 'Northern', 'Vector', 'Harbor',
+               'Pioneer', 'Silver', 'Eagle', 'Union', 'Liberty', 'Quantum', 'Cedar', 'Meridian', 'Frontier', 'Keystone']
+_NAME_NOUNS = ['Dynamics', 'Holdings', 'Systems', 'Energy', 'Pharmaceuticals', 'Capital', 'Technologies', 'Foods',
+               'Networks', 'Minerals', 'Logistics', 'Bancorp', 'Therapeutics', 'Industries', 'Semiconductor']
+_NAME_SUFFIXES = ['Inc', 'Corp', 'Co', 'Ltd', 'Group', 'Trust']
+_STATES = ['DE', 'CA', 'NY', 'TX', 'NV', 'FL', 'MA', 'NJ', 'IL', 'WA', 'PA', 'CO', 'GA', 'OH', 'MN']
+_SIC_CODES = ['7372', '2834', '6022', '1311', '6798', '3674', '2836', '6770', '7370', '3841', '4911', '6199', '1000',
+              '3576', '5812', '4813', '6311', '2860', '3711', '8731']
+
+
+def _zipf_weights(n, exponent=1.1):
+    """Popularity by rank -- a few SIC codes, states and terms account for most rows, as in real filings"""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _term_vocabulary() -> List[str]:
+    return _CORE_TERMS + [f'{prefix} {noun}' for prefix in _TERM_PREFIXES for noun in _TERM_NOUNS]
+
+
+def generate_synthetic_db(edgar_db: EdgarDatabase, scale=1.0, seed=0, parsed_share=0.7) -> dict:
+    """
+    Fills a database with synthetic companies, filings and parsed values at the given scale factor. SIC codes, states
+    and terms follow Zipf-like popularity, filing counts per company vary, and the form mix follows _FORM_MIX.
+
+    :param parsed_share: share of filings that have been parsed -- the rest are left as parse candidates
+    :return: row counts per table
+    """
+    rng = np.random.default_rng(seed)
+    n_companies = max(int(BENCHMARK_BASE_COMPANIES * scale), 1)
+    terms = _term_vocabulary()
+    term_weights = _zipf_weights(len(terms))
+
+    counts = {DB_SIC_TABLE: len(_SIC_CODES), DB_COMPANY_TABLE: n_companies, DB_FILING_TABLE: 0, DB_FILING_DATA_TABLE: 0}
+
+    with edgar_db.db_eng.connect() as conn:
+        conn.execute('PRAGMA synchronous = OFF')  # a throwaway database -- trade durability for generation speed
+
+        with conn.begin():
+            conn.execute(SicInfo.__table__.insert(), [{'sic_code': sic, 'ad_office': 'Office of Synthetic Data',
+                                                       'industry_title': f'Industry {sic}'} for sic in _SIC_CODES])
+
+        sics = rng.choice(_SIC_CODES, size=n_companies, p=_zipf_weights(len(_SIC_CODES)))
+        states = rng.choice(_STATES, size=n_companies, p=_zipf_weights(len(_STATES)))
+        name_parts = (_NAME_WORDS, _NAME_NOUNS, _NAME_SUFFIXES)
+        companies = [{'company_cik': str(1000000 + i * 7).zfill(10),
+                      'company_name': ' '.join(rng.choice(words) for words in name_parts),
+                      'company_ticker': f'SYN{i}', 'company_sic': sics[i], 'company_state': states[i],
+                      'company_info_attempted': True} for i in range(n_companies)]
+
+        with conn.begin():
+            conn.execute(CompanyInfo.__table__.insert(), companies)
+
+        filing_rows = []
+        data_rows = []
+
+        for company in companies:
+            cik = company['company_cik']
+            n_filings = max(int(rng.negative_binomial(4, 4 / (4 + BENCHMARK_FILINGS_PER_COMPANY))), 1)
+            forms = rng.choice(list(_FORM_MIX), size=n_filings, p=list(_FORM_MIX.values()))
+            first_year = int(rng.integers(2009, 2020))
+
+            for j in range(n_filings):
+                # roughly quarterly from the company's first year, filed about six weeks after period end
+                quarter = j % 4
+                period = (first_year + j // 4) * 10000 + [331, 630, 930, 1231][quarter]
+                filed = (period + 200 if quarter < 3 else period + 8900) * 1000000 + int(rng.integers(60000, 180000))
+                accession = f'{cik}-{str(first_year + j // 4)[2:]}-{j:06d}'
+                parsed = bool(rng.random() < parsed_share)
+
+                filing_rows.append({'company_cik': cik, 'filing_accession': accession, 'form': forms[j],
+                                    'period': period, 'filed': filed,
+                                    'filing_url': f'https://www.sec.gov/Archives/edgar/data/{cik}/{accession}.htm',
+                                    'excel_url': f'https://www.sec.gov/Archives/edgar/data/{cik}/{accession}.xlsx',
+                                    'excel_path': f'xlsx_data/{cik}_{accession}.xlsx' if parsed else None,
+                                    'parsed_data': parsed, 'parsing_attempted': parsed,
+                                    'parser_version': PARSER_VERSION if parsed else None})
+
+                if parsed:
+                    # balance sheet, P&L and cash flow, each reporting this period and the comparative one
+                    for filing_type in ('BS', 'PL', 'CF'):
+                        statement_terms = rng.choice(terms, size=BENCHMARK_TERMS_PER_STATEMENT, replace=False,
+                                                     p=term_weights)
+                        values = rng.lognormal(15, 2.5, size=(len(statement_terms), 2)).round()
+
+                        for value_period, column in ((period, 0), (period - 10000, 1)):
+                            data_rows.extend({'filing_accession': accession, 'filing_term': term,
+                                              'filing_type': filing_type, 'filing_value': float(value),
+                                              'value_period': value_period}
+                                             for term, value in zip(statement_terms, values[:, column]))
+
+            if len(data_rows) >= BENCHMARK_INSERT_BATCH:
+                counts[DB_FILING_TABLE] += len(filing_rows)
+                counts[DB_FILING_DATA_TABLE] += len(data_rows)
+                _insert(conn, filing_rows, data_rows)
+                filing_rows, data_rows = [], []
+
+        counts[DB_FILING_TABLE] += len(filing_rows)
+        counts[DB_FILING_DATA_TABLE] += len(data_rows)
+        _insert(conn, filing_rows, data_rows)
+
+    return counts
+
+
+def _insert(conn, filing_rows, data_rows):
+    with conn.begin():
+        if filing_rows:
+            conn.execute(FilingInfo.__table__.insert(), filing_rows)
+        if data_rows:
+            conn.execute(FilingData.__table__.insert().prefix_with('OR IGNORE'), data_rows)
+
+
+def _timed(operation: Callable, repeat: int) -> float:
+    """Median wall time of an operation, in seconds"""
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def _sample_sheet(terms, rng):
+    """A parsed statement as handed to set_filing_data -- header row of periods, then term / value rows"""
+    sheet = [['', 'Dec. 31, 2018', 'Dec. 31, 2017']]
+    sheet += [[term, float(a), float(b)] for term, a, b in zip(terms, *rng.lognormal(15, 2.5, size=(2, len(terms))))]
+    return np.array(sheet, dtype=object)
+
+
+def benchmark_operations(edgar_db: EdgarDatabase, repeat=3, seed=0) -> Dict[str, float]:
+    """Times each EdgarDatabase operation against an already populated database"""
+    rng = np.random.default_rng(seed)
+    edgar_db.make_session()
+
+    ciks = [r.company_cik for r in edgar_db.select_all_distinct_ciks()]
+    accessions = [r[0] for r in edgar_db.session.query(FilingInfo.filing_accession).all()]
+    few_ciks = list(rng.choice(ciks, size=min(100, len(ciks)), replace=False))
+    many_ciks = list(rng.choice(ciks, size=min(2500, len(ciks)), replace=False))
+    some_accessions = list(rng.choice(accessions, size=min(500, len(accessions)), replace=False))
+    candidate_filters = filing_filters(forms=VALID_FORMS, unattempted=True)
+
+    results = {
+        'select_all_filings': _timed(edgar_db.select_all_filings, repeat),
+        'select_filings_by_ciks (100)': _timed(lambda: edgar_db.select_filings_by_ciks(few_ciks), repeat),
+        'select_filings_by_ciks (2500, chunked)': _timed(lambda: edgar_db.select_filings_by_ciks(many_ciks), repeat),
+        'select_filings_by_accessions (500)': _timed(lambda: edgar_db.select_filings_by_accessions(some_accessions),
+                                                     repeat),
+        # the query behind select_ciks_by_name, which exits when nothing matches
+        'select_ciks_by_name': _timed(lambda: edgar_db.session.query(CompanyInfo.company_cik).filter(
+            CompanyInfo.company_name.ilike('%holdings%')).all(), repeat),
+        'parse candidates (filing_filters)': _timed(lambda: edgar_db.select_all_filings(candidate_filters), repeat),
+    }
+
+    # set_filing_data writes a statement per call, so each repeat needs a filing that hasn't been parsed yet
+    unparsed = edgar_db.select_filings_by_accessions([r[0] for r in edgar_db.session.query(
+        FilingInfo.filing_accession).filter(FilingInfo.parsed_data.isnot(True)).limit(repeat).all()])
+    sheets = iter([_sample_sheet(rng.choice(_term_vocabulary(), size=BENCHMARK_TERMS_PER_STATEMENT, replace=False),
+                                 rng) for _ in unparsed])
+    filings = iter(unparsed)
+
+    if unparsed:
+        results['set_filing_data'] = _timed(lambda: edgar_db.set_filing_data(next(filings), next(sheets), 'PL'),
+                                            len(unparsed))
+
+    results['parse_filings --csv merge'] = _timed(edgar_db.parsed_data_frame, max(repeat // 2, 1))
+    results['refresh_summaries (rebuild)'] = _timed(lambda: edgar_db.refresh_summaries(rebuild=True), 1)
+    results['latest_balance_sheet'] = _timed(lambda: edgar_db.latest_balance_sheet(few_ciks[0]), repeat)
+    results['term_coverage'] = _timed(edgar_db.term_coverage, repeat)
+
+    edgar_db.close_session()
+
+    return results
+
+
+def run_benchmarks(scales: List[float], repeat=3, work_dir: Optional[Path] = None, keep_db=False, seed=0) -> dict:
+    """
+    Generates a synthetic database per scale factor and times each operation on it.
+
+    :return: dict of scale -> {'rows': table row counts, 'seconds': operation timings}
+    """
+    work_dir = Path(work_dir) if work_dir else ROOT_DIR.joinpath('benchmark')
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+
+    for scale in scales:
+        db_loc = work_dir.joinpath(f'benchmark_{scale:g}.sqlite3')
+        if db_loc.exists():
+            db_loc.unlink()
+
+        edgar_db = EdgarDatabase(db_loc=db_loc)
+
+        start = time.time()
+        rows = generate_synthetic_db(edgar_db, scale, seed=seed)
+        print(f'Scale {scale:g}: generated {rows[DB_FILING_DATA_TABLE]} {DB_FILING_DATA_TABLE} rows in '
+              f'{time.time() - start:.0f} seconds.')
+
+        results[scale] = {'rows': rows, 'seconds': benchmark_operations(edgar_db, repeat, seed)}
+        edgar_db.dispose()  # stops its writer thread, which would otherwise hold the deleted file open
+
+        if not keep_db:
+            db_loc.unlink()
+
+    return results
+
+
+def scaling_exponents(results: dict) -> Dict[str, Optional[float]]:
+    """
+    How each operation's time grows with filing_data rows between the smallest and largest scale, as the exponent k
+    in time ~ rows^k -- about 1 is linear, well above 1 needs looking at.
+    """
+    scales = sorted(results)
+    if len(scales) < 2:
+        return {}
+
+    first, last = results[scales[0]], results[scales[-1]]
+    row_ratio = last['rows'][DB_FILING_DATA_TABLE] / max(first['rows'][DB_FILING_DATA_TABLE], 1)
+    exponents = {}
+
+    for operation, seconds in last['seconds'].items():
+        first_seconds = first['seconds'].get(operation)
+        if not first_seconds or row_ratio <= 1:
+            exponents[operation] = None
+        else:
+            exponents[operation] = math.log(seconds / first_seconds) / math.log(row_ratio)
+
+    return exponents
+
+
+def compare_to_baseline(results: dict, baseline_path) -> Dict[str, float]:
+    """Ratio of each timing to the same scale and operation in an earlier results file -- above 1 is slower"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    ratios = {}
+    for scale, result in results.items():
+        baseline_seconds = baseline.get(f'{scale:g}', {}).get('seconds', {})
+        for operation, seconds in result['seconds'].items():
+            if baseline_seconds.get(operation):
+                ratios[f'{operation} @ {scale:g}'] = seconds / baseline_seconds[operation]
+
+    return ratios
+
+
+def save_results(results: dict, out_path) -> Path:
+    out_path = Path(out_path)
+    with open(out_path, 'w') as f:
+        json.dump({f'{scale:g}': result for scale, result in results.items()}, f, indent=2)
+    return out_path
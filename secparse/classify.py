@@ -0,0 +1,157 @@
+import re
+from collections import namedtuple
+from typing import Optional
+
+from .utilities import flatten
+
+# Rules are (value, pattern) pairs listed in priority order -- where several rules of one kind match a header, the
+# earliest listed wins (e.g. a cash flow statement header will also mention operating income)
+STATEMENT_RULES = [
+    ('BS', r'\bbalance\s+sheets?\b|\bfinancial\s+(?:position|condition)\b'),
+    ('CF', r'\bcash\s+flows?\b'),
+    ('PL', r'\boperatio|\brevenue|\bincome\b|\bearnings\b'),
+]
+
+# sheets describing a statement rather than being one
+EXCLUDE_RULES = [
+    (True, r'\bparenthetical|\((?:details|tables|policies)'),
+]
+
+# 'comprehensive income' isn't a P&L keyword by itself -- a title naming nothing else is a standalone statement of
+# comprehensive income, which restates P&L terms that would clash on write. Combined statements ('Operations and
+# Comprehensive Income') are kept
+COMPREHENSIVE_RULES = [
+    (True, r'\bcomprehensive(?:\s+(?:income|earnings|loss))?'),
+]
+
+# '$ in Millions' beats a bare 'Thousands' that may only refer to share counts
+UNIT_RULES = [
+    (1000, r'\$\s*in\s+thousands'),
+    (1000000, r'\$\s*in\s+millions'),
+    (1000000000, r'\$\s*in\s+billions'),
+    (1000, r'\bthousands\b'),
+    (1000000, r'\bmillions\b'),
+    (1000000000, r'\bbillions\b'),
+]
+
+PERIOD_RULES = [
+    (3, r'\b(?:3|three)\s+months'),
+    (6, r'\b(?:6|six)\s+months'),
+    (9, r'\b(?:9|nine)\s+months'),
+    (12, r'\b(?:12|twelve)\s+months'),
+]
+
+# sheet names worth reading from a Financial_Report workbook -- the header rules above make the final call
+# (names are cut to 31 characters, e.g. 'CONSOLIDATED STATEMENTS OF CASH' and 'CONSOLIDATED STATEMENTS OF INCO')
+SHEET_NAME_RE = r'\bbalance|\bfinancial\s+(?:posi|cond)|\boper|\bof\s+(?:inc|earn)|\bcash\b|\bcond.*?\bconso'
+
+# comprehensive rules come first, so 'comprehensive income' is consumed before the P&L rule can match its 'income'
+_RULE_KINDS = [('comprehensive', COMPREHENSIVE_RULES), ('statement', STATEMENT_RULES), ('exclude', EXCLUDE_RULES),
+               ('unit', UNIT_RULES), ('period', PERIOD_RULES)]
+
+# every rule compiled into a single alternation of named groups, so a header is scanned once for all of them
+_RULE_LOOKUP = {f'{kind}_{rank}': (kind, rank, value)
+                for kind, rules in _RULE_KINDS for rank, (value, _) in enumerate(rules)}
+_HEADER_RE = re.compile('|'.join(f'(?P<{kind}_{rank}>{pattern})'
+                                 for kind, rules in _RULE_KINDS for rank, (_, pattern) in enumerate(rules)),
+                        flags=re.IGNORECASE)
+_PERIOD_RE = re.compile('|'.join(f'(?P<period_{rank}>{pattern})' for rank, (_, pattern) in enumerate(PERIOD_RULES)),
+                        flags=re.IGNORECASE)
+
+
+class SheetMatch(namedtuple('SheetMatch', ['statement', 'unit_multiplier', 'period_months'])):
+    """Classification of a single sheet: statement type, multiplier to 1 USD and months covered (None for a BS)"""
+
+    @property
+    def filing_type(self) -> str:
+        """Label stored against parsed values -- 12 month statements keep the plain 'PL' / 'CF' labels"""
+        if self.period_months is None or self.period_months == 12:
+            return self.statement
+        return f'{self.statement}{self.period_months}'
+
+
+def header_text(df, header_rows=5) -> str:
+    """Joins the first few rows of a sheet into a single string for rule matching"""
+    return ' '.join(str(val) for val in flatten(df.iloc[:header_rows, :].values.tolist()))
+
+
+def scan_header(text: str) -> dict:
+    """
+    Runs every rule over the text in one pass.
+
+    :return: dict of rule kind -> list of (rank, value) matches, in order of appearance
+    """
+    matches = {kind: [] for kind, _ in _RULE_KINDS}
+
+    for match in _HEADER_RE.finditer(text):
+        kind, rank, value = _RULE_LOOKUP[match.lastgroup]
+        matches[kind].append((rank, value))
+
+    return matches
+
+
+def classify_title(title: str) -> Optional[str]:
+    """Statement type for a report / sheet title, or None if it isn't one we parse"""
+    matches = scan_header(title)
+
+    if matches['exclude'] or not matches['statement']:
+        return None
+
+    return min(matches['statement'])[1]
+
+
+def classify_sheet(df) -> Optional[SheetMatch]:
+    """
+    Classifies a sheet from its header rows. P&L and cash flow sheets must state the period they cover -- where several
+    are given (e.g. a 10-Q's 3 and 9 month columns) the shortest is used.
+    """
+    if df is None or df.empty:
+        return None
+
+    matches = scan_header(header_text(df))
+
+    if matches['exclude'] or not matches['statement']:
+        return None
+
+    # the statement's title is its first row -- rows below it may mention net income on any statement
+    title_matches = scan_header(header_text(df, header_rows=1))
+    if title_matches['comprehensive'] and not title_matches['statement']:
+        return None
+
+    statement = min(matches['statement'])[1]
+    unit_multiplier = min(matches['unit'])[1] if matches['unit'] else 1
+
+    if statement == 'BS':
+        return SheetMatch(statement, unit_multiplier, None)
+
+    if not matches['period']:
+        return None
+
+    return SheetMatch(statement, unit_multiplier, min(value for _, value in matches['period']))
+
+
+def select_period(df, period_months: int, header_rows=5):
+    """
+    Cuts a sheet down to the columns covering the given number of months, dropping the row of period labels.
+
+    Period labels ('3 Months Ended') sit above the dates they apply to and, being merged cells, only fill the first
+    column they span -- so labels are carried right until the next one.
+    """
+    for row_num in range(min(header_rows, df.shape[0])):
+        labels = [_PERIOD_RE.search(str(val)) for val in df.iloc[row_num, 1:]]
+
+        if not any(labels):
+            continue
+
+        columns = [df.columns[0]]
+        current_months = None
+
+        for col, label in zip(df.columns[1:], labels):
+            if label:
+                current_months = PERIOD_RULES[int(label.lastgroup.split('_')[1])][0]
+            if current_months == period_months:
+                columns.append(col)
+
+        return df.drop(index=df.index[row_num])[columns]
+
+    return df
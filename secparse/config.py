@@ -5,6 +5,10 @@ import requests_oauthlib
 ROOT_DIR = Path.home().joinpath("sec_parse_data")
 DB_FILE_LOC = ROOT_DIR.joinpath("sec_parse_db.sqlite3")
 
+# Split filing_info / filing_data into one SQLite file per filing year, kept in DB_SHARD_DIR (see shard_database)
+DB_SHARDED = False
+DB_SHARD_DIR = ROOT_DIR.joinpath("shards")
+
 # Yahoo API key (some finance tables require authorisation)
 AUTH = requests_oauthlib.OAuth1(
     'dj0yJmk9anpzUDNHSjdoaEZvJmQ9WVdrOVIwZDBXRlpTTkdNbWNHbzlNQS0tJnM9Y29uc3VtZXJzZWNyZXQmeD0xOA--',
@@ -14,6 +18,66 @@ AUTH = requests_oauthlib.OAuth1(
 # Parallelisation config
 MULTIPROCESSING_NUMBER = 25
 
+# DuckDB threads for analytic queries (EdgarDatabase.term_history etc.) -- None uses every core
+ANALYTICS_THREADS = None
+
+# Rows read from the database at a time when exporting a panel (export_panel)
+PANEL_CHUNK_SIZE = 100000
+
+# Records written per transaction when importing Edgar full-index files (import_index)
+INDEX_IMPORT_BATCH_SIZE = 50000
+
+# Offline ticker lookup -- bulk ticker / name mapping (SEC's company_tickers.json by default, or a CSV of ticker,name
+# [,cik]), lowest name similarity accepted as a match, and whether to fall back to the web APIs on a miss
+TICKER_MAP_FILE = ROOT_DIR.joinpath("company_tickers.json")
+TICKER_MAP_URL = 'https://www.sec.gov/files/company_tickers.json'
+RESOLVER_MIN_SCORE = 0.8
+RESOLVER_NETWORK_FALLBACK = False
+
+# Filings downloading or downloaded-but-unparsed at once with parse_filings --pipeline
+PIPELINE_MAX_IN_FLIGHT = 2 * MULTIPROCESSING_NUMBER
+
+# Single writer (`secparse writer`) -- address commands send their writes to, file holding the key they authenticate
+# with, most write batches folded into one commit, how long to hold a commit open for more batches (0 commits
+# whatever has queued up straight away), and longest a command waits for its batch to be committed before giving up.
+# Without a running service each command writes through its own writer thread
+WRITER_ADDRESS = ('localhost', 8766)
+WRITER_KEY_FILE = ROOT_DIR.joinpath("writer.key")
+WRITER_MAX_GROUP = 500
+WRITER_MAX_DELAY_SECONDS = 0
+WRITER_WAIT_SECONDS = 600
+
+# Seconds a SQLite connection waits on another's write lock before giving up with "database is locked"
+SQLITE_BUSY_SECONDS = 60
+
+# Parse queue config (parse_filings --enqueue / worker) -- seconds a claimed filing stays reserved for a worker
+# without a heartbeat, filings claimed at a time, attempts before a filing is given up on, idle poll interval
+QUEUE_LEASE_SECONDS = 600
+QUEUE_BATCH_SIZE = 20
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_POLL_SECONDS = 30
+
+# Watch daemon -- seconds between feed polls, port for its /health and /metrics endpoint (served on localhost only),
+# and how many feed accessions it remembers having ingested (two months of feed entries fit comfortably)
+WATCH_INTERVAL_SECONDS = 300
+WATCH_HEALTH_PORT = 8765
+WATCH_SEEN_ACCESSIONS = 100000
+
+# Version of the parsing rules (classify.py / _clean_data_file) -- bump whenever they change so `secparse reparse`
+# picks up filings parsed under the old rules
+PARSER_VERSION = 1
+
+# Download checks -- smallest / largest file accepted as a workbook, streaming chunk size, (connect, read) timeouts
+# in seconds so a stalled connection fails rather than hanging, and how long to wait before retrying a failed
+# download (doubles with each further failure, up to the max). Filings with no financial report wait longest
+MIN_WORKBOOK_BYTES = 1024
+MAX_WORKBOOK_BYTES = 50 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)
+NEGATIVE_CACHE_RETRY_SECONDS = 60 * 60
+NEGATIVE_CACHE_MISSING_SECONDS = 7 * 24 * 60 * 60
+NEGATIVE_CACHE_MAX_SECONDS = 90 * 24 * 60 * 60
+
 # Valid form types to try parsing -- changing not recommended
 VALID_FORMS = ['10-Q', '10-K', '10-Q/A', 'S-4', '8-K']
 
@@ -22,3 +86,12 @@ DB_FILING_TABLE = 'filing_info'
 DB_FILING_DATA_TABLE = 'filing_data'
 DB_COMPANY_TABLE = 'company_info'
 DB_SIC_TABLE = 'sic_info'
+DB_JOB_TABLE = 'parse_jobs'
+
+# Summary tables kept up to date from newly parsed filings (see EdgarDatabase.refresh_summaries), and the number of
+# filings' values read at a time when refreshing them
+DB_LATEST_BS_TABLE = 'summary_latest_bs'
+DB_TERM_COVERAGE_TABLE = 'summary_term_coverage'
+DB_SIC_MEDIAN_TABLE = 'summary_sic_medians'
+DB_SUMMARIZED_TABLE = 'summary_filings'
+SUMMARY_REFRESH_CHUNK = 2000
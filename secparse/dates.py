@@ -0,0 +1,73 @@
+import datetime as dt
+import re
+from functools import lru_cache
+from typing import Optional, Union
+
+import dateutil.parser
+import pandas as pd
+
+# column headers in Financial_Report sheets / R-files, e.g. 'Dec. 31, 2017', 'Sept. 30, 2017', 'June 30, 2017'
+_HEADER_DATE_RE = re.compile(r'^\s*([A-Za-z]{3})[A-Za-z]*\.?\s+(\d{1,2}),?\s+(\d{4})\b')
+
+_MONTHS = {month: i for i, month in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+
+
+@lru_cache(maxsize=4096)
+def _parse_fallback(date_str: str) -> Optional[dt.datetime]:
+    """dateutil is slow, but the same handful of header strings repeat across thousands of filings"""
+    try:
+        return dateutil.parser.parse(date_str)
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_header_date(date_str: str) -> Optional[dt.datetime]:
+    """Parses a statement column header date, falling back to dateutil for anything non-standard"""
+    match = _HEADER_DATE_RE.match(date_str)
+
+    if match:
+        month = _MONTHS.get(match.group(1).lower())
+        try:
+            if month:
+                return dt.datetime(int(match.group(3)), month, int(match.group(2)))
+        except ValueError:
+            pass
+
+    return _parse_fallback(date_str.strip())
+
+
+def parse_edgar_date(value: Union[str, int]) -> Optional[dt.datetime]:
+    """Parses Edgar's compact dates -- '%Y%m%d' periods and '%Y%m%d%H%M%S' acceptance times"""
+    date_str = str(value).strip()
+
+    if not date_str.isdigit() or len(date_str) not in (8, 14):
+        return None
+
+    try:
+        if len(date_str) == 8:
+            return dt.datetime(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:]))
+
+        return dt.datetime(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:8]),
+                           int(date_str[8:10]), int(date_str[10:12]), int(date_str[12:]))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def display_date(value: Union[str, int], date_format: str = '%m/%d/%Y') -> str:
+    """Pretty-prints an Edgar compact date -- blank if it can't be parsed"""
+    parsed = parse_edgar_date(value)
+
+    if parsed is None:
+        return ''
+
+    return parsed.strftime(date_format)
+
+
+def edgar_dates_to_datetime(series: pd.Series) -> pd.Series:
+    """Vectorised parse of a column of Edgar compact dates (either length), unparseable values become NaT"""
+    date_strs = series.astype('Int64').astype('string')
+
+    # stored acceptance times carry the time of day -- only the date part is of interest for analysis
+    return pd.to_datetime(date_strs.str.slice(0, 8), format='%Y%m%d', errors='coerce')
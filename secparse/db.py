@@ -1,15 +1,26 @@
-from sqlalchemy import create_engine, Column, String, BigInteger, ForeignKey, Float, Index, Boolean, distinct
+from sqlalchemy import create_engine, Column, String, BigInteger, Integer, ForeignKey, Float, Index, Boolean, \
+    distinct, and_, or_, func, select, inspect, event, text
 from sqlalchemy.exc import IntegrityError, StatementError
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.horizontal_shard import ShardedSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql import exists
 
-import datetime as dt
-import dateutil.parser
 import sys
+import time
+from collections import Counter
+from typing import List
 
+import pandas as pd
+
+from .analytics import AnalyticsBackend
 from .config import *
+from .dates import edgar_dates_to_datetime, parse_header_date
+from .shards import MAIN_SHARD, SHARDED_TABLES, MAX_ATTACHED_SHARDS, ShardRouter, attach_shards, default_shard_years, \
+    shard_path, shard_years_on_disk
 from .utilities import flatten
+from .writer import WriteError, apply_ops, close_writer, get_writer, write_op
 
 Base = declarative_base()
 
@@ -46,8 +57,20 @@ class FilingInfo(Base):
     excel_path = Column(String)
     parsed_data = Column(Boolean)
     parsing_attempted = Column(Boolean)
-
-    Index("FILING_CIK_IDX", "company_cik", "filing_accession")
+    parser_version = Column(Integer)
+    workbook_hash = Column(String)
+    download_failures = Column(Integer)
+    download_retry_after = Column(BigInteger)  # unix time
+    excel_size = Column(BigInteger)
+    excel_checksum = Column(String)  # sha256 of the downloaded workbook
+
+    # composite indexes behind the filters in filing_filters -- a CIK search narrowed by date, and the parse_filings
+    # candidate query (valid form, not yet attempted, optionally by date). The candidate index only holds unattempted
+    # filings, as `parsing_attempted IS NOT 1` can't be looked up in an index -- it has to match the query's term
+    __table_args__ = (Index("FILING_CIK_IDX", "company_cik", "filing_accession"),
+                      Index("FILING_CIK_FILED_IDX", "company_cik", "filed"),
+                      Index("FILING_UNATTEMPTED_IDX", "form", "filed", sqlite_where=text('parsing_attempted IS NOT 1')),
+                      Index("FILING_PERIOD_IDX", "period"))
 
 
 class FilingData(Base):
@@ -55,30 +78,303 @@ class FilingData(Base):
 
     filing_accession = Column(String, ForeignKey(FilingInfo.filing_accession), primary_key=True)
     filing_term = Column(String, primary_key=True)
-    filing_type = Column(String)
+    filing_type = Column(String, primary_key=True)  # a P&L and cash flow statement can both report e.g. Net Income
     filing_value = Column(Float)
     value_period = Column(BigInteger, primary_key=True)
 
+    # behind the summary table refresh, which reads a period's values across companies
+    __table_args__ = (Index("FILING_DATA_PERIOD_IDX", "value_period", "filing_term"), )
+
+
+class LatestBalanceSheet(Base):
+    """Each company's most recent balance sheet values"""
+    __tablename__ = DB_LATEST_BS_TABLE
+
+    company_cik = Column(String, primary_key=True)
+    filing_term = Column(String, primary_key=True)
+    filing_value = Column(Float)
+    value_period = Column(BigInteger)
+    filing_accession = Column(String)
+
+
+class TermCoverage(Base):
+    """Number of parsed filings of each form that report a term"""
+    __tablename__ = DB_TERM_COVERAGE_TABLE
+
+    form = Column(String, primary_key=True)
+    filing_type = Column(String, primary_key=True)
+    filing_term = Column(String, primary_key=True)
+    filings = Column(Integer)
+
+
+class SicTermMedian(Base):
+    """Cross-sectional median of a term per SIC code and period, taking each company's latest filed value"""
+    __tablename__ = DB_SIC_MEDIAN_TABLE
+
+    company_sic = Column(String, primary_key=True)
+    filing_type = Column(String, primary_key=True)
+    filing_term = Column(String, primary_key=True)
+    value_period = Column(BigInteger, primary_key=True)
+    median_value = Column(Float)
+    companies = Column(Integer)
+
+
+class SummarizedFiling(Base):
+    """Filings counted in TermCoverage, so a filing is never counted twice"""
+    __tablename__ = DB_SUMMARIZED_TABLE
+
+    filing_accession = Column(String, primary_key=True)
+    form = Column(String)
+
+    __table_args__ = (Index("SUMMARIZED_FORM_IDX", "form"), )
+
+
+SUMMARY_MODELS = [LatestBalanceSheet, TermCoverage, SicTermMedian, SummarizedFiling]
+
+
+def _date_int(date, time_suffix=''):
+    return int(f'{date.year:04d}{date.month:02d}{date.day:02d}{time_suffix}')
+
+
+def filing_filters(date_range=None, date_field='filed', forms=None, unattempted=False) -> list:
+    """
+    SQL predicates narrowing a filing search, so the database (and its indexes) does the filtering.
+
+    :param date_range: (from, to) datetimes, inclusive of both days -- e.g. as returned by user_date_range
+    :param date_field: 'filed' (acceptance date) or 'period' (period of report)
+    :param forms: only filings of these form types
+    :param unattempted: only filings parse_filings hasn't yet attempted
+    """
+    filters = []
+
+    if date_range is not None:
+        range_min, range_max = date_range
+
+        # filed is stored as %Y%m%d%H%M%S, period as %Y%m%d
+        if date_field == 'filed':
+            filters.append(FilingInfo.filed.between(_date_int(range_min, '000000'), _date_int(range_max, '235959')))
+        else:
+            filters.append(FilingInfo.period.between(_date_int(range_min), _date_int(range_max)))
+
+    if forms:
+        filters.append(FilingInfo.form.in_(list(forms)))
+
+    if unattempted:
+        filters.append(FilingInfo.parsing_attempted.isnot(True))
+
+    return filters
+
+
+def _records(df: pd.DataFrame) -> List[dict]:
+    """DataFrame rows as dicts of plain Python values, ready to execute as statement parameters"""
+    return [dict(zip(df.columns, row)) for row in df.itertuples(index=False, name=None)]
+
+
+# indexes since replaced, dropped from existing databases
+_RETIRED_INDEXES = ['FILING_PARSE_STATE_IDX']
+
+
+def _rebuild_table(db_eng, table, existing_columns):
+    """
+    Recreates a table whose primary key has changed (which SQLite can't alter in place), copying its rows over. The
+    old key is a subset of the new one, so every row still has a unique key
+    """
+    columns = ', '.join(c.name for c in table.columns if c.name in existing_columns)
+
+    with db_eng.begin() as conn:
+        for index in inspect(db_eng).get_indexes(table.name):
+            conn.execute(f'DROP INDEX {index["name"]}')
+
+        conn.execute(f'ALTER TABLE {table.name} RENAME TO {table.name}_old')
+        table.create(conn)
+        conn.execute(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old')
+        conn.execute(f'DROP TABLE {table.name}_old')
+
+
+def _create_tables(db_eng, tables):
+    """
+    create_all, plus the columns and indexes create_all won't add to tables that already exist, and the rebuild of
+    any whose primary key has changed
+    """
+    Base.metadata.create_all(db_eng, tables=tables)
+    inspector = inspect(db_eng)
+
+    for index_name in _RETIRED_INDEXES:
+        db_eng.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+    for table in tables:
+        existing_key = inspector.get_pk_constraint(table.name)['constrained_columns']
+
+        if set(existing_key) != {column.name for column in table.primary_key}:
+            _rebuild_table(db_eng, table, {column['name'] for column in inspector.get_columns(table.name)})
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name not in existing_columns:
+                db_eng.execute(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                               f'{column.type.compile(db_eng.dialect)}')
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db_eng)
+
 
 class EdgarDatabase(object):
-    def __init__(self):
-        self.db_eng = create_engine(f'sqlite:///{DB_FILE_LOC}', echo=False)
-        self._sessionmaker = sessionmaker(autocommit=False)
-        self._sessionmaker.configure(bind=self.db_eng)
-        Base.metadata.create_all(self.db_eng)
+    def __init__(self, years=None, db_loc=None):
+        """
+        :param years: with DB_SHARDED, the filing years to read -- at most MAX_ATTACHED_SHARDS, defaulting to the
+        most recent. Filings from other years can still be written.
+        :param db_loc: a database file other than DB_FILE_LOC (e.g. for benchmarks) -- always unsharded
+        """
+        self.db_loc = Path(db_loc) if db_loc else DB_FILE_LOC
+        self.db_eng = create_engine(f'sqlite:///{self.db_loc}', echo=False,
+                                    connect_args={'timeout': SQLITE_BUSY_SECONDS})
+        self.shard_router = None
+        self._writer = None
+
+        if DB_SHARDED and db_loc is None:
+            years = list(years) if years else default_shard_years()
+
+            if len(years) > MAX_ATTACHED_SHARDS:
+                raise ValueError(f'At most {MAX_ATTACHED_SHARDS} years of filings can be queried at once '
+                                 f'({len(years)} requested).')
+
+            sharded_tables = [t for t in Base.metadata.sorted_tables if t.name in SHARDED_TABLES]
+            self.db_eng.execute('PRAGMA journal_mode = WAL')  # shard connections read company_info while it's written
+            _create_tables(self.db_eng, [t for t in Base.metadata.sorted_tables if t.name not in SHARDED_TABLES])
+
+            self.shard_router = ShardRouter(self.db_eng, years, lambda eng: _create_tables(eng, sharded_tables))
+            event.listen(self.db_eng, 'connect',
+                         lambda dbapi_conn, _: attach_shards(dbapi_conn, self.shard_router.filing_shards()))
+
+            self._sessionmaker = sessionmaker(class_=ShardedSession, autocommit=False,
+                                              shard_chooser=self.shard_router.shard_chooser,
+                                              id_chooser=self.shard_router.id_chooser,
+                                              query_chooser=self.shard_router.query_chooser)
+        else:
+            self._sessionmaker = sessionmaker(autocommit=False)
+            self._sessionmaker.configure(bind=self.db_eng)
+            _create_tables(self.db_eng, Base.metadata.sorted_tables)
+
+        self._analytics = None
+
+        # filings whose parsed values have changed since the summary tables were last refreshed -- those cleared
+        # for reparsing keep the values they had, as they're no longer in filing_data to be subtracted
+        self._summary_written = set()
+        self._summary_cleared = {}
+
+    @property
+    def writer(self):
+        """
+        This process's single writer for the database (see writer.py) -- None when sharded, as shards are written
+        through the session. One that has failed (e.g. the writer service stopped) is replaced
+        """
+        if (self._writer is None or self._writer.broken) and self.shard_router is None:
+            self._writer = get_writer(self.db_loc, Base.metadata)
+        return self._writer
+
+    def _write(self, ops) -> int:
+        """
+        Writes a batch of ops (writer.write_op). Through the writer, it's committed once this returns and never holds
+        the session's transaction open. Sharded databases apply the batch to each row's shard within the session
+        transaction instead, to be committed with it.
+        """
+        if self.writer is not None:
+            return self.writer.submit(ops)
+
+        affected = 0
+        for kind, table_name, rows, keys in ops:
+            rows_by_shard = {}
+            for row in rows:
+                rows_by_shard.setdefault(self.shard_router.row_shard(table_name, row), []).append(row)
+
+            for shard_id, shard_rows in rows_by_shard.items():
+                if shard_id != MAIN_SHARD:
+                    # a year outside those being queried is still written, as with shard_chooser
+                    self._bind_shard(shard_id)
+
+                affected += apply_ops(self.session.connection(shard_id=shard_id), Base.metadata,
+                                      [(kind, table_name, shard_rows, keys)])
+
+        return affected
+
+    def _bind_shard(self, year):
+        """Adds a year's shard to the session, for one outside the years being queried"""
+        if year not in self.shard_router.engines:
+            self.session.bind_shard(year, self.shard_router.engine(year))
+
+    def _all_filing_rows(self, query) -> list:
+        """
+        Rows of a query on the filing tables. Sharded, it's run against every shard on disk rather than only the years
+        being queried -- for the summary tables, which cover every parsed filing
+        """
+        if self.shard_router is None:
+            return query.all()
+
+        rows = []
+        for year in shard_years_on_disk():
+            self._bind_shard(year)
+            rows += query.set_shard(year).all()
+
+        return rows
+
+    def _update_filing_rows(self, updates):
+        """
+        Writes new column values for filing_info rows, and sets them on the loaded objects to match.
+
+        :param updates: list of (FilingInfo, dict of column values) -- each dict with the same columns
+        """
+        if not updates:
+            return
+
+        self._write([write_op('update', DB_FILING_TABLE,
+                              [dict(values, filing_accession=filing.filing_accession) for filing, values in updates],
+                              keys=['filing_accession'])])
+
+        for filing, values in updates:
+            for column, value in values.items():
+                set_committed_value(filing, column, value)
+
+    @property
+    def analytics(self):
+        """DuckDB engine over this database for aggregate queries -- created on first use"""
+        if self._analytics is None:
+            shard_paths = [shard_path(year) for year in shard_years_on_disk()] if self.shard_router else None
+            self._analytics = AnalyticsBackend(self.db_loc, shard_paths=shard_paths)
+        return self._analytics
 
     def make_session(self):
         """Removing from __init__ lets us instantiate an EdgarDatabase object at the module level, dynamically
         create and close sessions once DB engine has been bound to the sessionmaker"""
-        self.session = self._sessionmaker(expire_on_commit=False)
+        if self.shard_router is not None:
+            self.session = self._sessionmaker(expire_on_commit=False, shards=self.shard_router.shards())
+        else:
+            self.session = self._sessionmaker(expire_on_commit=False)
 
     def close_session(self):
         try:
+            self.refresh_summaries()
             self.session.commit()
             self.session.close()
         except ConnectionError as err:
             raise err
 
+        if self._analytics is not None:
+            self._analytics.close()
+            self._analytics = None
+
+    def dispose(self):
+        """Stops the database's writer and closes its connections -- for a database that's finished with"""
+        if self._writer is not None:
+            close_writer(self.db_loc)
+            self._writer = None
+
+        self.db_eng.dispose()
+
     def _check_exists(self, column, value):
         res = self.session.query(distinct(column)).filter(exists().where(column == value)).first()
 
@@ -96,14 +392,14 @@ class EdgarDatabase(object):
     def check_accession_exists(self, accession):
         return self._check_exists(FilingInfo.filing_accession, accession)
 
-    def select_all_filings(self):
-        return self.session.query(FilingInfo, CompanyInfo).join(CompanyInfo).all()
+    def select_all_filings(self, filters=()):
+        return self.session.query(FilingInfo, CompanyInfo).join(CompanyInfo).filter(*filters).all()
 
-    def _select_filings(self, query_col, query_terms):
+    def _select_filings(self, query_col, query_terms, filters=()):
 
         if len(query_terms) < 999:  # sqlite query term limit
             return self.session.query(FilingInfo, CompanyInfo).join(CompanyInfo).filter(
-                query_col.in_(query_terms)).all()
+                query_col.in_(query_terms), *filters).all()
 
         else:  # if length of parameters is longer than sqlite then chunk the request and compile return
             query_return_list = list()
@@ -112,13 +408,13 @@ class EdgarDatabase(object):
             for query_term_chunk in query_term_chunks:
                 query_return_list.append(
                     self.session.query(FilingInfo, CompanyInfo).join(CompanyInfo).filter(
-                        query_col.in_(query_term_chunk)).all()
+                        query_col.in_(query_term_chunk), *filters).all()
                 )
 
             return flatten(query_return_list)
 
-    def select_filings_by_ciks(self, cik_nums):
-        return self._select_filings(CompanyInfo.company_cik, cik_nums)
+    def select_filings_by_ciks(self, cik_nums, filters=()):
+        return self._select_filings(FilingInfo.company_cik, cik_nums, filters)
 
     def select_filings_by_accessions(self, accession_nums):
         return self._select_filings(FilingInfo.filing_accession, accession_nums)
@@ -150,16 +446,299 @@ class EdgarDatabase(object):
     def select_ciks_by_name(self, company_name):
         return self._select_distinct_ciks(CompanyInfo.company_name, "%"+company_name+"%")
 
-    def update_excel_path(self, excel_path, filing_url):
+    def term_history(self, term, ciks=None, filing_type=None):
+        """Stored values of an accounting term by company and period, as a DataFrame (DuckDB)"""
+        self.session.commit()  # analytic queries only see committed rows
+        return self.analytics.term_history(term, ciks, filing_type)
+
+    def sic_term_medians(self, term, filing_type=None, period_from=None, period_to=None):
+        """Median value of an accounting term per SIC code and period, as a DataFrame (DuckDB)"""
+        self.session.commit()
+        return self.analytics.sic_term_medians(term, filing_type, period_from, period_to)
+
+    def parsed_data_frame(self) -> pd.DataFrame:
+        """Every parsed value joined to its filing, company and SIC information (as written by parse_filings --csv)"""
+        sic_df = pd.read_sql_table(DB_SIC_TABLE, self.db_eng)
+        company_df = pd.read_sql_table(DB_COMPANY_TABLE, self.db_eng)
+        filing_info_df = pd.read_sql_table(DB_FILING_TABLE, self.db_eng)
+        filing_data_df = pd.read_sql_table(DB_FILING_DATA_TABLE, self.db_eng)
+
+        for date_df, date_col in [(filing_info_df, 'period'), (filing_info_df, 'filed'),
+                                  (filing_data_df, 'value_period')]:
+            date_df[date_col] = edgar_dates_to_datetime(date_df[date_col])
+
+        little_data_df = pd.merge(filing_data_df, filing_info_df, how='left')
+        some_data_df = pd.merge(little_data_df, company_df, how='left')
+        return pd.merge(some_data_df, sic_df, how='left', left_on='company_sic', right_on='sic_code')
+
+    def _summary_source_rows(self, accessions) -> pd.DataFrame:
+        """Parsed values of the given filings, with the company / form details the summary tables are keyed on"""
+        columns = [FilingData.filing_accession, FilingInfo.company_cik, CompanyInfo.company_sic, FilingInfo.form,
+                   FilingData.filing_type, FilingData.filing_term, FilingData.value_period]
+        rows = []
+
+        for i in range(0, len(accessions), 995):  # sqlite query term limit
+            rows += self._all_filing_rows(self.session.query(*columns).select_from(FilingData).join(
+                FilingInfo, FilingInfo.filing_accession == FilingData.filing_accession).outerjoin(
+                CompanyInfo, CompanyInfo.company_cik == FilingInfo.company_cik).filter(
+                FilingData.filing_accession.in_(accessions[i:i + 995])))
+
+        return pd.DataFrame(rows, columns=[c.key for c in columns])
+
+    @staticmethod
+    def _replace_ops(model, keys: pd.DataFrame, rows: pd.DataFrame) -> list:
+        """Write ops deleting a summary table's rows matching each row of keys, then inserting rows"""
+        return [write_op('delete', model.__tablename__, _records(keys), keys=list(keys.columns)),
+                write_op('insert', model.__tablename__, _records(rows))]
+
+    def _latest_balance_sheet_ops(self, ciks) -> list:
+        ops = []
+
+        for i in range(0, len(ciks), 995):
+            cik_chunk = ciks[i:i + 995]
+            rows = self._all_filing_rows(self.session.query(
+                FilingInfo.company_cik, FilingData.filing_term, FilingData.filing_value, FilingData.value_period,
+                FilingData.filing_accession, FilingInfo.filed).select_from(FilingData).join(
+                FilingInfo, FilingInfo.filing_accession == FilingData.filing_accession).filter(
+                FilingData.filing_type == 'BS', FilingInfo.company_cik.in_(cik_chunk)))
+
+            df = pd.DataFrame(rows, columns=['company_cik', 'filing_term', 'filing_value', 'value_period',
+                                             'filing_accession', 'filed'])
+
+            # only the latest balance sheet date, and where several filings report it, the last one filed
+            df = df[df.value_period == df.groupby('company_cik').value_period.transform('max')]
+            df = df.sort_values('filed').drop_duplicates(['company_cik', 'filing_term'], keep='last')
+
+            ops += self._replace_ops(LatestBalanceSheet, pd.DataFrame({'company_cik': cik_chunk}),
+                                     df.drop(columns='filed'))
+
+        return ops
+
+    def _sic_median_ops(self, groups: pd.DataFrame) -> list:
+        keys = ['company_sic', 'filing_type', 'filing_term']
+        ops = []
+
+        # a period's values are read once for every touched SIC, then cut down to the touched groups
+        for period, period_groups in groups.groupby('value_period'):
+            period = int(period)
+            sics = list(period_groups.company_sic.unique())
+            rows = []
+
+            for i in range(0, len(sics), 995):
+                rows += self._all_filing_rows(self.session.query(
+                    CompanyInfo.company_sic, FilingData.filing_type, FilingData.filing_term, FilingInfo.company_cik,
+                    FilingInfo.filed, FilingData.filing_value).select_from(FilingData).join(
+                    FilingInfo, FilingInfo.filing_accession == FilingData.filing_accession).join(
+                    CompanyInfo, CompanyInfo.company_cik == FilingInfo.company_cik).filter(
+                    FilingData.value_period == period, CompanyInfo.company_sic.in_(sics[i:i + 995])))
+
+            df = pd.DataFrame(rows, columns=keys + ['company_cik', 'filed', 'filing_value'])
+            df = df.merge(period_groups[keys], on=keys)
+            df['filing_value'] = pd.to_numeric(df.filing_value, errors='coerce')
+            df = df.dropna(subset=['filing_value']).sort_values('filed').drop_duplicates(keys + ['company_cik'],
+                                                                                        keep='last')
+
+            medians = df.groupby(keys).filing_value.agg(median_value='median', companies='count').reset_index()
+            medians['value_period'] = period
+
+            ops += self._replace_ops(SicTermMedian, period_groups, medians)
+
+        return ops
+
+    def refresh_summaries(self, rebuild=False):
+        """
+        Brings the summary tables up to date with the filings written (set_filing_data) or cleared
+        (delete_filing_data) since the last refresh. Term coverage is adjusted by those filings alone; latest balance
+        sheets and SIC medians are recomputed only for the companies and SIC / term / period groups they touch. Sharded,
+        they're read from every shard on disk, not only the years this instance queries.
+
+        Every new summary row is worked out first and written in a single batch, so the write lock is only held for
+        the write itself -- not while the summaries are computed.
+
+        :param rebuild: recompute the summary tables from every parsed filing instead
+        """
+        if rebuild:
+            ops = [write_op('delete', model.__tablename__, [{}]) for model in SUMMARY_MODELS]
+            written = [r.filing_accession for r in self._all_filing_rows(self.session.query(
+                FilingInfo.filing_accession).filter(FilingInfo.parsed_data.is_(True)))]
+            cleared = {}
+        else:
+            ops = []
+            written = list(self._summary_written)
+            cleared = self._summary_cleared
+
+        if not written and not cleared:
+            return
+
+        self.session.commit()
+        summary_keys = ['form', 'filing_type', 'filing_term']
+        counted = set()
+
+        # a rebuild starts from empty tables -- the batch clears them before anything else
+        for i in range(0, 0 if rebuild else len(cleared) + len(written), 995):
+            chunk = (list(cleared) + written)[i:i + 995]
+            counted.update(r.filing_accession for r in self.session.query(SummarizedFiling.filing_accession).filter(
+                SummarizedFiling.filing_accession.in_(chunk)).all())
+
+        touched = []
+        coverage = Counter()
+
+        for accession, rows in cleared.items():
+            touched.append(rows)
+
+            if accession in counted:
+                coverage.subtract(rows[summary_keys].drop_duplicates().itertuples(index=False, name=None))
+                ops.append(write_op('delete', DB_SUMMARIZED_TABLE, [{'filing_accession': accession}],
+                                    keys=['filing_accession']))
+                counted.discard(accession)
+
+        for i in range(0, len(written), SUMMARY_REFRESH_CHUNK):
+            rows = self._summary_source_rows(written[i:i + SUMMARY_REFRESH_CHUNK])
+            new_rows = rows[~rows.filing_accession.isin(counted)]
+
+            coverage.update(new_rows[['filing_accession'] + summary_keys].drop_duplicates()[summary_keys]
+                            .itertuples(index=False, name=None))
+            ops.append(write_op('insert_or_ignore', DB_SUMMARIZED_TABLE,
+                                _records(new_rows[['filing_accession', 'form']].drop_duplicates())))
+            touched.append(rows.drop(columns=['filing_accession', 'form']).drop_duplicates())
+
+        # added to the stored counts in the write itself, so refreshes from other processes can't overwrite each other
+        ops.append(write_op('add', DB_TERM_COVERAGE_TABLE, [
+            {'form': form, 'filing_type': filing_type, 'filing_term': filing_term, 'filings': change}
+            for (form, filing_type, filing_term), change in coverage.items() if change != 0]))
+        ops.append(write_op('delete', DB_TERM_COVERAGE_TABLE, [{'filings': 0}], keys=['filings']))
+
+        if touched:
+            touched = pd.concat(touched)
+            ops += self._latest_balance_sheet_ops(list(touched.company_cik.dropna().unique()))
+            ops += self._sic_median_ops(touched.dropna(subset=['company_sic'])[
+                ['company_sic', 'filing_type', 'filing_term', 'value_period']].drop_duplicates())
+
+        self._write(ops)
+        if self.writer is None:
+            self.session.commit()
 
-        for c in self.session.query(FilingInfo).filter(FilingInfo.filing_url == filing_url).all():
-            c.excel_path = str(excel_path)
+        self._summary_written = set()
+        self._summary_cleared = {}
+
+    def latest_balance_sheet(self, cik) -> pd.DataFrame:
+        """A company's most recent balance sheet, read from the summary tables"""
+        rows = self.session.query(LatestBalanceSheet).filter(LatestBalanceSheet.company_cik == cik).order_by(
+            LatestBalanceSheet.filing_term).all()
+
+        return pd.DataFrame([(r.filing_term, r.filing_value, r.value_period, r.filing_accession) for r in rows],
+                            columns=['filing_term', 'filing_value', 'value_period', 'filing_accession'])
+
+    def term_coverage(self, form=None, filing_type=None) -> pd.DataFrame:
+        """Number and share of parsed filings of each form reporting each term, read from the summary tables"""
+        query = self.session.query(TermCoverage)
+        if form:
+            query = query.filter(TermCoverage.form == form)
+        if filing_type:
+            query = query.filter(TermCoverage.filing_type == filing_type)
+
+        form_filings = dict(self.session.query(SummarizedFiling.form, func.count()).group_by(
+            SummarizedFiling.form).all())
+
+        df = pd.DataFrame([(r.form, r.filing_type, r.filing_term, r.filings) for r in query.all()],
+                          columns=['form', 'filing_type', 'filing_term', 'filings'])
+        df['share'] = df.filings / df.form.map(form_filings)
+
+        return df.sort_values(['form', 'filings'], ascending=[True, False]).reset_index(drop=True)
+
+    def summary_sic_medians(self, term, filing_type=None, period_from=None, period_to=None) -> pd.DataFrame:
+        """As sic_term_medians, but read from the summary tables rather than computed from every parsed value"""
+        query = self.session.query(SicTermMedian).filter(SicTermMedian.filing_term == term)
+        if filing_type:
+            query = query.filter(SicTermMedian.filing_type == filing_type)
+        if period_from:
+            query = query.filter(SicTermMedian.value_period >= int(period_from))
+        if period_to:
+            query = query.filter(SicTermMedian.value_period <= int(period_to))
+
+        return pd.DataFrame([(r.company_sic, r.filing_type, r.value_period, r.median_value, r.companies)
+                             for r in query.order_by(SicTermMedian.company_sic, SicTermMedian.value_period).all()],
+                            columns=['sic_code', 'filing_type', 'value_period', 'median_value', 'companies'])
+
+    def select_filings_to_reparse(self, since_version):
+        """
+        Parsed filings of a valid form type whose parser version is older than since_version, or whose parse failed
+        """
+        return self.session.query(FilingInfo, CompanyInfo).join(CompanyInfo).filter(and_(
+            FilingInfo.form.in_(VALID_FORMS),
+            FilingInfo.parsing_attempted.is_(True),
+            or_(FilingInfo.parser_version.is_(None),
+                FilingInfo.parser_version < since_version,
+                FilingInfo.parsed_data.isnot(True)))).all()
+
+    def delete_filing_data(self, accession):
+        """Removes a filing's parsed values ahead of it being reparsed"""
+        if accession not in self._summary_cleared:
+            self._summary_cleared[accession] = self._summary_source_rows([accession])
+
+        key = {'filing_accession': accession}
+        self._write([write_op('delete', DB_FILING_DATA_TABLE, [key], keys=['filing_accession']),
+                     write_op('update', DB_FILING_TABLE, [dict(key, parsed_data=False)], keys=['filing_accession'])])
+
+        for c in self.session.query(FilingInfo).filter(FilingInfo.filing_accession == accession).all():
+            set_committed_value(c, 'parsed_data', False)
+
+    def record_parse(self, accession, workbook_hash):
+        """Stamps a filing with the parser version used on it and the hash of the workbook it was parsed from"""
+        self._update_filing_rows([(c, {'parser_version': PARSER_VERSION, 'workbook_hash': workbook_hash})
+                                  for c in self.session.query(FilingInfo).filter(
+                                      FilingInfo.filing_accession == accession).all()])
+
+    def mark_parsing_attempted(self, filings: List[FilingInfo]):
+        self._update_filing_rows([(c, {'parsing_attempted': True}) for c in filings])
+
+    def record_download(self, excel_url, excel_path, excel_size=None, excel_checksum=None):
+        """Stores where a filing's statements were downloaded to, clearing any negative cache entry"""
+        values = {'excel_path': str(excel_path) if excel_path else None,  # None when parsed from memory
+                  'excel_size': excel_size, 'excel_checksum': excel_checksum, 'download_failures': 0,
+                  'download_retry_after': None}
+
+        self._update_filing_rows([(c, values) for c in self.session.query(FilingInfo).filter(
+            FilingInfo.excel_url == excel_url).all()])
+
+    def record_download_failure(self, excel_url, missing=False):
+        """
+        Negative cache -- holds off retrying a failed download, doubling the wait each time it fails again. Filings with
+        no financial report at all (missing) wait far longer than those that failed for transient reasons.
+        """
+        base_wait = NEGATIVE_CACHE_MISSING_SECONDS if missing else NEGATIVE_CACHE_RETRY_SECONDS
+        updates = []
+
+        for c in self.session.query(FilingInfo).filter(FilingInfo.excel_url == excel_url).all():
+            failures = (c.download_failures or 0) + 1
+            updates.append((c, {'download_failures': failures, 'download_retry_after': int(time.time()) + min(
+                base_wait * 2 ** (failures - 1), NEGATIVE_CACHE_MAX_SECONDS)}))
+
+        self._update_filing_rows(updates)
 
-    def insert_objects(self, objects):
+    def update_excel_path(self, excel_path, filing_url):
+        self._update_filing_rows([(c, {'excel_path': str(excel_path)}) for c in self.session.query(FilingInfo).filter(
+            FilingInfo.filing_url == filing_url).all()])
+
+    def _write_objects(self, kind, objects):
         if type(objects) != list:
             objects = [objects]
 
-        self.session.add_all(objects)
+        # only the attributes that have been set, as with session.merge -- rows of an op must share their columns
+        rows_by_columns = {}
+        for obj in objects:
+            row = {c.name: obj.__dict__[c.key] for c in obj.__table__.columns if c.key in obj.__dict__}
+            rows_by_columns.setdefault((obj.__tablename__, tuple(row)), []).append(row)
+
+        self._write([write_op(kind, table_name, rows) for (table_name, _), rows in rows_by_columns.items()])
+
+    def insert_objects(self, objects):
+        """Writes new rows for unsaved model objects -- any whose primary key is already stored are left alone"""
+        self._write_objects('insert_or_ignore', objects)
+
+    def merge_objects(self, objects):
+        """Like insert_objects, but updates rows that already exist"""
+        self._write_objects('upsert', objects)
 
     def set_filing_data(self, filing: FilingInfo, data, filing_type) -> bool:
         """Adds parsed excel data to data table from individual filing object"""
@@ -172,6 +751,7 @@ class EdgarDatabase(object):
             return clean_date_str
 
         num_columns = data.shape[1]
+        rows_to_insert = []
 
         for column_num in range(1, num_columns):
             # find the time period the data refers to (this is usually cell B1 & C1)
@@ -179,37 +759,254 @@ class EdgarDatabase(object):
                 prepped_date = prep_date(data[0, column_num])
 
                 if prepped_date:
-                    period = dt.datetime.strftime(dateutil.parser.parse(prepped_date), '%Y%m%d')
+                    header_date = parse_header_date(prepped_date)
                 else:
                     return False
+
+                if header_date is None:
+                    raise ValueError(f'Unrecognised period header: {prepped_date}')
+
+                period = header_date.strftime('%Y%m%d')
             except (TypeError, ValueError, IndexError):
-                self.session.rollback()  # rollback the session so no partially-written data is preserved
-                return False
+                return False  # nothing has been written yet, so no partially-written data is preserved
 
-            rows_to_insert = []
             for row in data[1:]:
                 # check to see if values field is blank, exclude header row
                 if not row[-1]:
                     continue
 
-                rows_to_insert.append(FilingData(
-                    filing_accession=filing.FilingInfo.filing_accession,
-                    filing_term=row[0],
-                    filing_value=row[column_num],
-                    value_period=period,
-                    filing_type=filing_type))
-
-            try:
-                self.session.add_all(rows_to_insert)
-
-                for c in self.session.query(FilingInfo).filter(
-                        FilingInfo.filing_accession == filing.FilingInfo.filing_accession).all():
-                    c.parsed_data = True
+                rows_to_insert.append({'filing_accession': filing.FilingInfo.filing_accession,
+                                       'filing_term': row[0],
+                                       'filing_value': row[column_num],
+                                       'value_period': period,
+                                       'filing_type': filing_type})
 
-            except (IntegrityError, StatementError):
+        # every period of the sheet is written in one batch -- a term repeated in the sheet (or already stored from
+        # another of the filing's statements of the same type) keeps its first value
+        try:
+            self._write([write_op('insert_or_ignore', DB_FILING_DATA_TABLE, rows_to_insert),
+                         write_op('update', DB_FILING_TABLE, [{'filing_accession': filing.FilingInfo.filing_accession,
+                                                              'parsed_data': True}], keys=['filing_accession'])])
+        except (WriteError, IntegrityError, StatementError):
+            if self.writer is None:
                 self.session.rollback()
-                return False
+            return False
 
+        if self.writer is None:
             self.session.commit()
 
+        set_committed_value(filing.FilingInfo, 'parsed_data', True)
+        self._summary_written.add(filing.FilingInfo.filing_accession)
+
         return True
+
+
+def move_filings_to_shards() -> dict:
+    """
+    Moves filing_info / filing_data rows out of the main database into per-year shard files, for switching an
+    existing database over to DB_SHARDED. The main database's filing tables are dropped once every row is copied.
+
+    :return: dict of year -> filings moved
+    """
+    db_eng = create_engine(f'sqlite:///{DB_FILE_LOC}', echo=False)
+
+    if not db_eng.has_table(DB_FILING_TABLE):
+        return {}
+
+    sharded_tables = [t for t in Base.metadata.sorted_tables if t.name in SHARDED_TABLES]
+    _create_tables(db_eng, sharded_tables)  # bring old databases up to the current columns first
+
+    filing_columns = ', '.join(c.name for c in FilingInfo.__table__.columns)
+    data_columns = ', '.join(c.name for c in FilingData.__table__.columns)
+    data_select = ', '.join('fd.' + c.name for c in FilingData.__table__.columns)
+
+    years = [r[0] for r in db_eng.execute(f'SELECT DISTINCT filed / 10000000000 FROM {DB_FILING_TABLE} '
+                                          f'WHERE filed IS NOT NULL ORDER BY 1')]
+    moved = {}
+
+    for year in years:
+        DB_SHARD_DIR.mkdir(parents=True, exist_ok=True)
+        _create_tables(create_engine(f'sqlite:///{shard_path(year)}', echo=False), sharded_tables)
+        year_range = (year * 10 ** 10, (year + 1) * 10 ** 10)
+
+        with db_eng.connect() as conn:
+            conn.execute(f"ATTACH DATABASE '{shard_path(year)}' AS shard")
+
+            with conn.begin():
+                conn.execute(f'INSERT OR IGNORE INTO shard.{DB_FILING_TABLE} ({filing_columns}) '
+                             f'SELECT {filing_columns} FROM main.{DB_FILING_TABLE} WHERE filed >= ? AND filed < ?',
+                             *year_range)
+                conn.execute(f'INSERT OR IGNORE INTO shard.{DB_FILING_DATA_TABLE} ({data_columns}) '
+                             f'SELECT {data_select} FROM main.{DB_FILING_DATA_TABLE} fd '
+                             f'JOIN main.{DB_FILING_TABLE} fi ON fi.filing_accession = fd.filing_accession '
+                             f'WHERE fi.filed >= ? AND fi.filed < ?', *year_range)
+
+            moved[year] = conn.execute(f'SELECT count(*) FROM main.{DB_FILING_TABLE} WHERE filed >= ? AND filed < ?',
+                                       *year_range).scalar()
+            conn.execute('DETACH DATABASE shard')
+
+    # filings without a filed date have no shard to go to, so leave everything in place for them
+    if sum(moved.values()) == db_eng.execute(f'SELECT count(*) FROM {DB_FILING_TABLE}').scalar():
+        db_eng.execute(f'DROP TABLE {DB_FILING_DATA_TABLE}')
+        db_eng.execute(f'DROP TABLE {DB_FILING_TABLE}')
+        db_eng.execute('VACUUM')
+
+    return moved
+
+
+QueueBase = declarative_base()
+
+
+class ParseJob(QueueBase):
+    __tablename__ = DB_JOB_TABLE
+
+    filing_accession = Column(String, primary_key=True)
+    status = Column(String)  # pending / leased / done / failed
+    worker_id = Column(String)
+    lease_expires = Column(BigInteger)  # unix time
+    attempts = Column(Integer)
+    retry_after = Column(BigInteger)  # unix time -- a filing whose download failed isn't claimed again until then
+
+    __table_args__ = (Index('JOB_STATUS_IDX', 'status', 'lease_expires'), )
+
+
+class ParseJobQueue(object):
+    """
+    Queue of filings to parse, shared by any number of `secparse worker` processes. Kept apart from the main tables so
+    it can live in the main database or in its own shared SQLite file.
+
+    Jobs are claimed with a conditional update, so a filing can only be leased to one worker at a time. Leases that
+    aren't renewed by a heartbeat expire, and the job becomes claimable again.
+    """
+
+    def __init__(self, queue_loc=None):
+        # wait on other workers' write locks rather than failing straight away
+        self.db_eng = create_engine(f'sqlite:///{queue_loc or DB_FILE_LOC}', echo=False, connect_args={'timeout': 30})
+        _create_tables(self.db_eng, QueueBase.metadata.sorted_tables)
+        self._jobs = ParseJob.__table__
+
+    def _claimable(self, now):
+        jobs = self._jobs
+        return and_(jobs.c.attempts < QUEUE_MAX_ATTEMPTS,
+                    or_(and_(jobs.c.status == 'pending', or_(jobs.c.retry_after.is_(None), jobs.c.retry_after <= now)),
+                        and_(jobs.c.status == 'leased', jobs.c.lease_expires < now)))
+
+    def enqueue(self, accessions) -> int:
+        """Adds filings to the queue, skipping any already on it unless they failed (those are retried). Returns number
+        added"""
+        jobs = self._jobs
+        accessions = list(set(accessions))
+        queued = 0
+
+        with self.db_eng.begin() as conn:
+            for i in range(0, len(accessions), 995):  # sqlite query term limit
+                accession_chunk = accessions[i:i + 995]
+                existing = {r.filing_accession for r in conn.execute(
+                    select([jobs.c.filing_accession]).where(jobs.c.filing_accession.in_(accession_chunk)))}
+
+                new_jobs = [{'filing_accession': accession, 'status': 'pending', 'attempts': 0}
+                            for accession in accession_chunk if accession not in existing]
+
+                if new_jobs:
+                    conn.execute(jobs.insert(), new_jobs)
+                queued += len(new_jobs)
+
+                queued += conn.execute(jobs.update().where(and_(
+                    jobs.c.filing_accession.in_(accession_chunk), jobs.c.status == 'failed')
+                ).values(status='pending', attempts=0, retry_after=None)).rowcount
+
+        return queued
+
+    def claim(self, worker_id, batch_size=QUEUE_BATCH_SIZE, lease_seconds=QUEUE_LEASE_SECONDS) -> List[str]:
+        """Leases up to batch_size pending (or expired) jobs to a worker. Returns the claimed accession numbers"""
+        jobs = self._jobs
+        now = int(time.time())
+        claimed = []
+
+        with self.db_eng.begin() as conn:
+            # expired jobs that have used up their attempts are given up on rather than handed out forever
+            conn.execute(jobs.update().where(and_(
+                jobs.c.status == 'leased', jobs.c.lease_expires < now, jobs.c.attempts >= QUEUE_MAX_ATTEMPTS)
+            ).values(status='failed', worker_id=None))
+
+            candidates = [r.filing_accession for r in conn.execute(
+                select([jobs.c.filing_accession]).where(self._claimable(now)).order_by(jobs.c.attempts)
+                .limit(batch_size))]
+
+            for accession in candidates:
+                # re-check claimability in the update itself, in case another worker got there first
+                result = conn.execute(jobs.update().where(and_(
+                    jobs.c.filing_accession == accession, self._claimable(now))
+                ).values(status='leased', worker_id=worker_id, lease_expires=now + lease_seconds,
+                         attempts=jobs.c.attempts + 1))
+
+                if result.rowcount:
+                    claimed.append(accession)
+
+        return claimed
+
+    def heartbeat(self, worker_id, lease_seconds=QUEUE_LEASE_SECONDS) -> int:
+        """Extends every lease a worker still holds. Returns number of leases renewed"""
+        jobs = self._jobs
+
+        with self.db_eng.begin() as conn:
+            return conn.execute(jobs.update().where(and_(
+                jobs.c.status == 'leased', jobs.c.worker_id == worker_id)
+            ).values(lease_expires=int(time.time()) + lease_seconds)).rowcount
+
+    def holds_lease(self, worker_id, accession) -> bool:
+        jobs = self._jobs
+
+        with self.db_eng.connect() as conn:
+            return conn.execute(select([jobs.c.filing_accession]).where(and_(
+                jobs.c.filing_accession == accession, jobs.c.status == 'leased', jobs.c.worker_id == worker_id,
+                jobs.c.lease_expires >= int(time.time())))).first() is not None
+
+    def complete(self, worker_id, accession, succeeded=True, retry_after=None):
+        """
+        Marks a job done or failed. A filing whose download failed (retry_after, its download_retry_after) goes back to
+        pending until then instead, without using up an attempt.
+        """
+        jobs = self._jobs
+
+        if retry_after is not None:
+            values = {'status': 'pending', 'worker_id': None, 'retry_after': retry_after,
+                      'attempts': jobs.c.attempts - 1}
+        else:
+            values = {'status': 'done' if succeeded else 'failed', 'retry_after': None}
+
+        with self.db_eng.begin() as conn:
+            conn.execute(jobs.update().where(and_(
+                jobs.c.filing_accession == accession, jobs.c.status == 'leased', jobs.c.worker_id == worker_id)
+            ).values(lease_expires=None, **values))
+
+    def retry(self, worker_id, accessions=None):
+        """
+        Hands a worker's jobs (all of them, or the given filings) back to the queue after a failed attempt. Unlike
+        release, the attempt counts -- a filing that has used up its attempts is given up on
+        """
+        jobs = self._jobs
+        held = and_(jobs.c.status == 'leased', jobs.c.worker_id == worker_id)
+        if accessions is not None:
+            held = and_(held, jobs.c.filing_accession.in_(list(accessions)))
+
+        with self.db_eng.begin() as conn:
+            conn.execute(jobs.update().where(and_(held, jobs.c.attempts >= QUEUE_MAX_ATTEMPTS)).values(
+                status='failed', worker_id=None, lease_expires=None))
+            conn.execute(jobs.update().where(held).values(status='pending', worker_id=None, lease_expires=None))
+
+    def release(self, worker_id):
+        """Hands a worker's unfinished jobs back to the queue without counting against their attempts"""
+        jobs = self._jobs
+
+        with self.db_eng.begin() as conn:
+            conn.execute(jobs.update().where(and_(
+                jobs.c.status == 'leased', jobs.c.worker_id == worker_id)
+            ).values(status='pending', worker_id=None, lease_expires=None, attempts=jobs.c.attempts - 1))
+
+    def status_counts(self) -> dict:
+        jobs = self._jobs
+
+        with self.db_eng.connect() as conn:
+            return {r.status: r.job_count for r in conn.execute(
+                select([jobs.c.status, func.count().label('job_count')]).group_by(jobs.c.status))}
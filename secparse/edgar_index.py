@@ -0,0 +1,180 @@
+import gzip
+import re
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from .config import *
+from .db import CompanyInfo, FilingInfo
+from .shards import filing_year
+from .utilities import filing_excel_url
+
+# header rows of form.idx / master.idx name the columns -- fixed-width files use their positions to slice records
+_INDEX_COLUMNS = {'Form Type': 'form', 'Company Name': 'company_name', 'CIK': 'cik', 'Date Filed': 'date_filed',
+                  'File Name': 'file_name', 'Filename': 'file_name'}
+
+
+def _open_index(index_path: Path):
+    if index_path.suffix == '.gz':
+        return gzip.open(index_path, 'rt', encoding='latin-1')
+    return open(index_path, 'r', encoding='latin-1')
+
+
+def iter_index_records(index_path) -> Iterator[dict]:
+    """
+    Streams filing records from an Edgar full-index file -- form.idx (fixed width) or master.idx (pipe delimited),
+    optionally gzipped.
+    """
+    index_path = Path(index_path)
+
+    with _open_index(index_path) as f:
+        header = None
+        column_starts = None
+
+        for line in f:
+            line = line.rstrip('\n')
+
+            # skip the preamble until the column header row, which is followed by a row of dashes
+            if column_starts is None:
+                if line.startswith('---') and header is not None:
+                    if '|' in header:
+                        column_starts = []
+                    else:
+                        column_starts = sorted((header.index(name), key) for name, key in _INDEX_COLUMNS.items()
+                                               if name in header)
+                elif any(name in line for name in ('Form Type', 'CIK|')):
+                    header = line
+                continue
+
+            if not line.strip():
+                continue
+
+            if column_starts:
+                record = {}
+                for i, (start, key) in enumerate(column_starts):
+                    end = column_starts[i + 1][0] if i + 1 < len(column_starts) else None
+                    record[key] = line[start:end].strip()
+            else:
+                values = line.split('|')
+                if len(values) != 5:
+                    continue
+                record = dict(zip(['cik', 'company_name', 'form', 'date_filed', 'file_name'], values))
+
+            yield record
+
+
+def index_record_to_rows(record: dict) -> Optional[tuple]:
+    """Turns an index record into (filing_info row, company_info row) dicts -- None if it can't be read"""
+    cik = record.get('cik', '').strip()
+    file_name = record.get('file_name', '').strip()
+    filed = record.get('date_filed', '').replace('-', '').strip()
+
+    if not cik.isdigit() or not file_name or not filed.isdigit():
+        return None
+
+    # Filename is the full submission text file, e.g. edgar/data/320193/0000320193-17-000070.txt
+    accession = Path(file_name).stem
+    cik = cik.zfill(10)  # match the zero-padded CIKs used by the XBRL feeds
+
+    filing_row = {
+        'company_cik': cik,
+        'filing_accession': accession,
+        'form': record.get('form', '').strip(),
+        'period': None,
+        'filed': int(filed.ljust(14, '0')),  # feed acceptance times are %Y%m%d%H%M%S
+        'filing_url': f'https://www.sec.gov/Archives/edgar/data/{cik.lstrip("0")}/{accession.replace("-", "")}/'
+                      f'{accession}-index.htm',
+        'excel_url': filing_excel_url(cik, accession),
+        'excel_path': None,
+        'parsed_data': False,
+    }
+
+    company_row = {
+        'company_cik': cik,
+        'company_name': re.sub("[^a-zA-Z ]+", "", record.get('company_name', '')).replace("  ", " ").strip().title(),
+        'company_info_attempted': False,  # leaves SIC / state / ticker for update_company_info to fill in
+    }
+
+    return filing_row, company_row
+
+
+def import_index_files(db_eng, index_paths: List, forms=VALID_FORMS, batch_size=INDEX_IMPORT_BATCH_SIZE,
+                       shard_router=None) -> dict:
+    """
+    Bulk-loads filing and company stubs from full-index files. Rows already in the database are left untouched.
+
+    :param forms: form types to keep -- None keeps every record
+    :param shard_router: with DB_SHARDED, the EdgarDatabase's ShardRouter -- filing rows are written to their year's
+    shard rather than through db_eng
+    :return: dict of index file path -> number of records read for import
+    """
+    filing_insert = FilingInfo.__table__.insert().prefix_with('OR IGNORE')
+    company_insert = CompanyInfo.__table__.insert().prefix_with('OR IGNORE')
+    forms = set(forms) if forms else None
+
+    records_read = {}
+
+    with db_eng.connect() as conn:
+        # a bulk load can be rerun if interrupted, so trade durability for speed while it runs
+        conn.execute('PRAGMA synchronous = OFF')
+
+        for index_path in index_paths:
+            filing_rows = []
+            company_rows = {}
+            read = 0
+
+            for record in iter_index_records(index_path):
+                if forms is not None and record.get('form') not in forms:
+                    continue
+
+                rows = index_record_to_rows(record)
+                if rows is None:
+                    continue
+
+                filing_rows.append(rows[0])
+                company_rows[rows[1]['company_cik']] = rows[1]
+                read += 1
+
+                if len(filing_rows) >= batch_size:
+                    _insert_batch(conn, company_insert, filing_insert, company_rows, filing_rows, shard_router)
+                    filing_rows = []
+                    company_rows = {}
+
+            if filing_rows:
+                _insert_batch(conn, company_insert, filing_insert, company_rows, filing_rows, shard_router)
+
+            records_read[str(index_path)] = read
+
+    return records_read
+
+
+def _insert_batch(conn, company_insert, filing_insert, company_rows, filing_rows, shard_router=None):
+    with conn.begin():
+        conn.execute(company_insert, list(company_rows.values()))
+
+        if shard_router is None:
+            conn.execute(filing_insert, filing_rows)
+            return
+
+    rows_by_year = {}
+    for row in filing_rows:
+        rows_by_year.setdefault(filing_year(row['filed']), []).append(row)
+
+    for year, year_rows in rows_by_year.items():
+        with shard_router.engine(year).begin() as shard_conn:
+            shard_conn.execute(filing_insert, year_rows)
+
+
+def find_index_files(paths) -> List[Path]:
+    """Expands directories (e.g. a local full-index mirror) into the form.idx / master.idx files within them"""
+    index_files = []
+
+    for path in paths:
+        path = Path(path)
+
+        if path.is_dir():
+            index_files.extend(sorted(p for p in path.rglob('*')
+                                      if p.name in ('form.idx', 'form.idx.gz', 'master.idx', 'master.idx.gz')))
+        else:
+            index_files.append(path)
+
+    return index_files
@@ -0,0 +1,116 @@
+import json
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from .config import *
+
+# one row per company / period / term -- where several filings report the same value (e.g. a restatement), SQLite's
+# bare-column MAX() takes the value from the most recently filed one
+_PANEL_ROWS_SQL = f"""
+    SELECT fi.company_cik AS company_cik, fd.value_period AS value_period, fd.filing_term AS filing_term,
+           CAST(fd.filing_value AS REAL) AS filing_value, MAX(fi.filed)
+    FROM {DB_FILING_DATA_TABLE} fd
+    JOIN {DB_FILING_TABLE} fi ON fi.filing_accession = fd.filing_accession
+    WHERE fd.filing_term IN :terms AND typeof(fd.filing_value) IN ('real', 'integer') {{type_filter}}
+    GROUP BY fi.company_cik, fd.value_period, fd.filing_term
+"""
+
+
+def _panel_query(outer_sql, filing_type):
+    """Wraps the panel rows query -- outer_sql refers to it as {rows}"""
+    rows_sql = _PANEL_ROWS_SQL.format(type_filter='AND fd.filing_type = :filing_type' if filing_type else '')
+    return text(outer_sql.format(rows=rows_sql)).bindparams(bindparam('terms', expanding=True))
+
+
+def build_panel(db_eng, terms: List[str], out_dir, filing_type: Optional[str] = None, sparse=False,
+                chunk_size=PANEL_CHUNK_SIZE) -> Path:
+    """
+    Writes parsed values for the given terms as a companies x periods x terms float32 panel, without holding the
+    long-format data in memory -- index maps are built with SQL first, then rows are streamed into a memory-mapped
+    .npy file.
+
+    Dense panels are written to panel.npy (missing values are NaN). Sparse panels are written in COO form:
+    panel_coords.npy (n x 3 int32 company / period / term indices) and panel_values.npy (float32). index.json maps
+    indices back to CIKs, %Y%m%d periods and terms.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    params = {'terms': list(terms)}
+    if filing_type:
+        params['filing_type'] = filing_type
+
+    with db_eng.connect() as conn:
+        companies = [r[0] for r in conn.execute(_panel_query(
+            'SELECT DISTINCT company_cik FROM ({rows}) ORDER BY company_cik', filing_type), params)]
+        periods = [r[0] for r in conn.execute(_panel_query(
+            'SELECT DISTINCT value_period FROM ({rows}) ORDER BY value_period', filing_type), params)]
+
+        company_index = {cik: i for i, cik in enumerate(companies)}
+        period_index = {period: i for i, period in enumerate(periods)}
+        term_index = {term: i for i, term in enumerate(terms)}
+
+        if sparse:
+            row_count = conn.execute(_panel_query('SELECT count(*) FROM ({rows})', filing_type), params).scalar()
+            coords = np.lib.format.open_memmap(out_dir.joinpath('panel_coords.npy'), mode='w+', dtype=np.int32,
+                                               shape=(row_count, 3))
+            values = np.lib.format.open_memmap(out_dir.joinpath('panel_values.npy'), mode='w+', dtype=np.float32,
+                                               shape=(row_count, ))
+        else:
+            panel = np.lib.format.open_memmap(out_dir.joinpath('panel.npy'), mode='w+', dtype=np.float32,
+                                              shape=(len(companies), len(periods), len(terms)))
+            panel[:] = np.nan
+
+        result = conn.execution_options(stream_results=True).execute(_panel_query('{rows}', filing_type), params)
+        written = 0
+
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            chunk_coords = np.array([(company_index[r.company_cik], period_index[r.value_period],
+                                      term_index[r.filing_term]) for r in rows], dtype=np.int32)
+            chunk_values = np.array([r.filing_value for r in rows], dtype=np.float32)
+
+            if sparse:
+                coords[written:written + len(rows)] = chunk_coords
+                values[written:written + len(rows)] = chunk_values
+            else:
+                panel[chunk_coords[:, 0], chunk_coords[:, 1], chunk_coords[:, 2]] = chunk_values
+
+            written += len(rows)
+
+    if sparse:
+        coords.flush()
+        values.flush()
+    else:
+        panel.flush()
+
+    with open(out_dir.joinpath('index.json'), 'w') as f:
+        json.dump({'format': 'coo' if sparse else 'dense', 'filing_type': filing_type,
+                   'shape': [len(companies), len(periods), len(terms)], 'values': written,
+                   'companies': companies, 'periods': periods, 'terms': list(terms)}, f)
+
+    return out_dir
+
+
+def load_panel(panel_dir, mmap_mode='r'):
+    """
+    Opens a panel written by build_panel without reading it into memory.
+
+    :return: (panel array, index dict) for dense panels, ((coords, values), index dict) for sparse ones
+    """
+    panel_dir = Path(panel_dir)
+
+    with open(panel_dir.joinpath('index.json')) as f:
+        index = json.load(f)
+
+    if index['format'] == 'coo':
+        return (np.load(panel_dir.joinpath('panel_coords.npy'), mmap_mode=mmap_mode),
+                np.load(panel_dir.joinpath('panel_values.npy'), mmap_mode=mmap_mode)), index
+
+    return np.load(panel_dir.joinpath('panel.npy'), mmap_mode=mmap_mode), index
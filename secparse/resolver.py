@@ -0,0 +1,149 @@
+import csv
+import json
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from .config import *
+from .db import CompanyInfo
+
+# words that say what kind of entity a company is rather than which one -- dropped before names are compared
+_NAME_STOPWORDS = {'the', 'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited', 'plc',
+                   'llc', 'lp', 'llp', 'sa', 'nv', 'ag', 'se', 'de', 'new', 'and'}
+
+# only the rarest few tokens of a name are used to find candidates, so common words like 'bancorp' stay cheap
+_CANDIDATE_TOKENS = 3
+
+
+def normalize_name(name: str) -> str:
+    """Lower case, punctuation and entity suffixes removed -- e.g. 'Apple Inc.' and 'APPLE INC' both give 'apple'"""
+    name = re.sub(r"[^a-z0-9 ]+", " ", str(name).lower().replace('&', ' and ').replace("'", ''))
+    return ' '.join(token for token in name.split() if token not in _NAME_STOPWORDS)
+
+
+class TickerResolver(object):
+    """
+    In-memory ticker lookup built from a bulk mapping file. Resolves by CIK where the mapping has one, then by exact
+    normalised name, then by IDF-weighted token similarity between names.
+    """
+
+    def __init__(self, entries: Iterable[tuple], min_score=RESOLVER_MIN_SCORE):
+        """
+        :param entries: (ticker, company name, cik or None) tuples -- where a CIK or name appears more than once, the
+        first entry wins (company_tickers.json lists a company's primary share class first)
+        """
+        self.min_score = min_score
+        self.by_cik = {}
+        self.by_name = {}
+        self._names = []
+        self._tickers = []
+        self._postings = defaultdict(list)
+
+        for ticker, name, cik in entries:
+            if cik:
+                self.by_cik.setdefault(str(cik).zfill(10), ticker)
+
+            normalized = normalize_name(name)
+            if not normalized or normalized in self.by_name:
+                continue
+
+            self.by_name[normalized] = ticker
+            entry_id = len(self._names)
+            self._names.append(set(normalized.split()))
+            self._tickers.append(ticker)
+
+            for token in self._names[entry_id]:
+                self._postings[token].append(entry_id)
+
+        self._idf = {token: math.log(1 + len(self._names) / len(ids)) for token, ids in self._postings.items()}
+
+    def __len__(self):
+        return len(self._tickers)
+
+    @classmethod
+    def from_file(cls, map_path=TICKER_MAP_FILE, min_score=RESOLVER_MIN_SCORE) -> 'TickerResolver':
+        """Loads SEC's company_tickers.json, or a CSV / tab separated file of ticker, name[, cik] rows"""
+        map_path = Path(map_path)
+
+        if map_path.suffix == '.json':
+            with open(map_path) as f:
+                records = json.load(f)
+            records = records.values() if isinstance(records, dict) else records
+            entries = [(r['ticker'], r['title'], r.get('cik_str')) for r in records]
+        else:
+            with open(map_path, newline='') as f:
+                dialect = csv.Sniffer().sniff(f.read(4096), delimiters=',\t|')
+                f.seek(0)
+                entries = [(row[0].strip(), row[1].strip(), row[2].strip() if len(row) > 2 else None)
+                           for row in csv.reader(f, dialect) if len(row) >= 2 and row[0].strip().lower() != 'ticker']
+
+        return cls(entries, min_score)
+
+    def score(self, query_tokens: set, entry_id: int) -> float:
+        """Weighted Jaccard similarity -- rare shared words count for more than common ones"""
+        entry_tokens = self._names[entry_id]
+        shared = sum(self._idf.get(token, 0) for token in query_tokens & entry_tokens)
+        union = sum(self._idf.get(token, math.log(1 + len(self._names))) for token in query_tokens | entry_tokens)
+        return shared / union if union else 0.0
+
+    def resolve_name(self, name: str) -> Optional[str]:
+        normalized = normalize_name(name or '')
+        if not normalized:
+            return None
+
+        if normalized in self.by_name:
+            return self.by_name[normalized]
+
+        query_tokens = set(normalized.split())
+        known_tokens = sorted((token for token in query_tokens if token in self._postings), key=self._idf.get,
+                              reverse=True)
+
+        candidates = set()
+        for token in known_tokens[:_CANDIDATE_TOKENS]:
+            candidates.update(self._postings[token])
+
+        best_score, best_id = 0.0, None
+        for entry_id in candidates:
+            entry_score = self.score(query_tokens, entry_id)
+            if entry_score > best_score:
+                best_score, best_id = entry_score, entry_id
+
+        return self._tickers[best_id] if best_id is not None and best_score >= self.min_score else None
+
+    def resolve(self, cik: Optional[str] = None, name: Optional[str] = None) -> Optional[str]:
+        if cik and str(cik).zfill(10) in self.by_cik:
+            return self.by_cik[str(cik).zfill(10)]
+        return self.resolve_name(name)
+
+    def resolve_companies(self, companies: List[CompanyInfo]) -> List[CompanyInfo]:
+        """Fills in company_ticker where it can be resolved -- returns the companies that couldn't be"""
+        misses = []
+
+        for company in companies:
+            ticker = self.resolve(company.company_cik, company.company_name)
+
+            if ticker:
+                company.company_ticker = ticker
+            else:
+                misses.append(company)
+
+        return misses
+
+
+_resolvers: Dict[tuple, TickerResolver] = {}
+
+
+def load_resolver(map_path=TICKER_MAP_FILE) -> Optional[TickerResolver]:
+    """The resolver for a mapping file, built once per process (and again if the file changes) -- None if missing"""
+    map_path = Path(map_path)
+
+    if not map_path.exists():
+        return None
+
+    key = (str(map_path), map_path.stat().st_mtime)
+    if key not in _resolvers:
+        _resolvers.clear()
+        _resolvers[key] = TickerResolver.from_file(map_path)
+
+    return _resolvers[key]
@@ -1,12 +1,21 @@
 import sys
 import platform
+import json
 import time
 import os
+import shutil
 import multiprocessing
+import threading
+import queue
+import signal
+import hashlib
+import io
+from collections import namedtuple
 from typing import List, Union, Optional
 
 from numpy import ndarray
-from sqlalchemy import distinct, func, and_
+from sqlalchemy import distinct, func, and_, or_
+from sqlalchemy.exc import SQLAlchemyError
 import feedparser
 import requests as rq
 from ssl import SSLError
@@ -17,8 +26,30 @@ import pandas as pd
 import click
 
 from .apis import api_name_to_ticker, api_cik_to_info
-from .db import EdgarDatabase, FilingInfo, CompanyInfo, SicInfo
+from .benchmark import compare_to_baseline, run_benchmarks, save_results, scaling_exponents
+from .classify import SHEET_NAME_RE, SheetMatch, classify_sheet, classify_title, select_period
+from .dates import display_date, parse_edgar_date
+from .db import Base, EdgarDatabase, FilingInfo, CompanyInfo, SicInfo, ParseJobQueue, filing_filters, \
+    move_filings_to_shards
+from .edgar_index import find_index_files, import_index_files
+from .panel import build_panel
+from .resolver import load_resolver
+from .shards import MAX_ATTACHED_SHARDS, years_for_range
 from .utilities import *
+from .watch import RecentSet, WatchMetrics, start_health_server
+from .writer import GroupCommitWriter, WriteError, WriterServer
+
+# download failure kinds -- a missing report is retried far less eagerly than e.g. a throttled request
+DOWNLOAD_MISSING = 'missing'
+DOWNLOAD_FAILED = 'failed'
+
+# xlsx (zip) and legacy xls (OLE2) signatures
+WORKBOOK_MAGIC = (b'PK\x03\x04', b'\xd0\xcf\x11\xe0')
+
+# outcome of downloading one filing's statements -- size and checksum (sha256) are None if the download failed. content
+# holds the workbook's bytes when it was downloaded to memory rather than disk (parse_filings --in_memory)
+DownloadResult = namedtuple('DownloadResult', ['path', 'excel_url', 'failure', 'size', 'checksum', 'content'],
+                            defaults=(None, ))
 
 
 # Click helper function for command line interface
@@ -29,7 +60,12 @@ def cli():
         raise Exception("Python 3.6 or a more recent version is required.")
 
     make_folders()
-    _build_sic_table()
+
+    edgar_db = EdgarDatabase()
+    edgar_db.make_session()
+    _build_sic_table(edgar_db)
+    edgar_db.close_session()
+
     print("\n")
 
 
@@ -75,11 +111,11 @@ def update_filings(manual, get_company_info, print_data=True, bisection_search=T
 
         date_to_find = dt.datetime.now() - dt.timedelta(days=update_timeframe)
         guess_i = (min_i + max_i) // 2
-        guess_date = dt.datetime.strptime(rss_data[guess_i]['edgar_acceptancedatetime'], '%Y%m%d%H%M%S')
+        guess_date = parse_edgar_date(rss_data[guess_i]['edgar_acceptancedatetime'])
         loop_num = 0
 
         while abs(date_to_find - guess_date) >= margin_error and loop_num <= 20:
-            guess_date = dt.datetime.strptime(rss_data[guess_i]['edgar_acceptancedatetime'], '%Y%m%d%H%M%S')
+            guess_date = parse_edgar_date(rss_data[guess_i]['edgar_acceptancedatetime'])
 
             if guess_date < date_to_find:
                 max_i = guess_i
@@ -103,10 +139,7 @@ def update_filings(manual, get_company_info, print_data=True, bisection_search=T
                 name = re.sub("[^a-zA-Z ]+", "", item['edgar_companyname']).replace("  ", " ").title()
                 cik = item['edgar_ciknumber']
                 form = item['edgar_formtype']
-                try:
-                    period = dt.datetime.strftime(dt.datetime.strptime(item['edgar_period'], '%Y%m%d'), '%m/%d/%Y')
-                except KeyError:
-                    period = ''
+                period = display_date(item.get('edgar_period', ''))
 
                 print(name[:30].ljust(30), cik.ljust(10), period.ljust(10), form.ljust(10), sep=' | ')
 
@@ -116,56 +149,92 @@ def update_filings(manual, get_company_info, print_data=True, bisection_search=T
         rss_data = _download_filings(year, month, print_data)
 
     if db_write:
-        _update_filings(rss_data, get_company_info)
+        edgar_db = EdgarDatabase()
+        edgar_db.make_session()
+        _update_filings(rss_data, get_company_info, edgar_db)
+        edgar_db.close_session()
     else:
         return rss_data
 
 
 @cli.command()
-@click.option('--search_type', type=click.Choice(['ticker', 'cik', 'all', 'sic', 'state', 'name']),
+@click.option('--search_type', type=click.Choice(['ticker', 'cik', 'all', 'sic', 'state', 'name', 'date']),
               default='all', help='Category of search term(s). List of possible SIC codes based on industry '
                                   'classification can be found at:\nhttps://www.sec.gov/info/edgar/siccodes.htm')
-def search_filings(search_type, print_results=True):
+@click.option('--from', 'date_from', default=None, help='Only filings on or after this date, e.g. 2018-01-01.')
+@click.option('--to', 'date_to', default=None, help='Only filings on or before this date.')
+@click.option('--date_field', type=click.Choice(['filed', 'period']), default='filed',
+              help='Date that --from / --to (and the date search type) apply to: when the filing was accepted, or '
+                   'the period it reports on.')
+def search_filings(search_type, date_from=None, date_to=None, date_field='filed', print_results=True):
     """Displays filing information stored for any companies matching the search criteria."""
 
-    edgar_db = EdgarDatabase()
+    date_range = _search_date_range(search_type, date_from, date_to, date_field)
+
+    # with a sharded database, only the shards for the date range are read
+    edgar_db = EdgarDatabase(years=_range_shard_years(date_range, date_field))
     edgar_db.make_session()
 
-    _searcher(search_type, edgar_db, print_results)
+    filters = filing_filters(date_range, date_field)
+    _searcher(search_type, edgar_db, print_results, filters=filters, date_field=date_field)
 
     edgar_db.close_session()
 
 
 @cli.command()
-@click.option('--search_type', type=click.Choice(['ticker', 'all', 'cik', 'sic', 'state', 'name']),
+@click.option('--search_type', type=click.Choice(['ticker', 'all', 'cik', 'sic', 'state', 'name', 'date']),
               default='all', help='Category of search term(s). List of possible SIC codes based on industry '
                                   'classification can be found at:\nhttps://www.sec.gov/info/edgar/siccodes.htm')
+@click.option('--from', 'date_from', default=None, help='Only filings on or after this date, e.g. 2018-01-01.')
+@click.option('--to', 'date_to', default=None, help='Only filings on or before this date.')
+@click.option('--date_field', type=click.Choice(['filed', 'period']), default='filed',
+              help='Date that --from / --to (and the date search type) apply to: when the filing was accepted, or '
+                   'the period it reports on.')
 @click.option('--csv/--no-csv', default=False, help='Save all parsed data to CSV file.')
-def parse_filings(search_type, csv=False):
+@click.option('--source', type=click.Choice(['xlsx', 'summary']), default='xlsx',
+              help='Where to pull statements from: the full Financial_Report workbook, or only the statement '
+                   'reports listed in the filing\'s FilingSummary.xml.')
+@click.option('--enqueue', default=False, is_flag=True, help='Add filings to the parse queue for `secparse worker` '
+                                                             'processes instead of parsing them here.')
+@click.option('--queue_db', default=None, type=click.Path(dir_okay=False),
+              help='Shared SQLite file holding the parse queue. Defaults to the main database.')
+@click.option('--pipeline', default=False, is_flag=True, help='Parse each filing as soon as it has downloaded, '
+                                                              'rather than once every download has finished.')
+@click.option('--in_memory', default=False, is_flag=True,
+              help='Parse workbooks straight from memory without saving them to xlsx_data/. Implies --pipeline.')
+def parse_filings(search_type, date_from=None, date_to=None, date_field='filed', csv=False, source='xlsx',
+                  enqueue=False, queue_db=None, pipeline=False, in_memory=False):
     """
-    Attempts to download, extract and store accounting data (P&L / BS) from filings for given companies / categories of
-    companies within search parameters. Optionally writes all parsed data to a CSV file.
+    Attempts to download, extract and store accounting data (P&L / BS / cash flow) from filings for given companies /
+    categories of companies within search parameters. Optionally writes all parsed data to a CSV file.
     """
 
-    edgar_db = EdgarDatabase()
+    if in_memory and source == 'summary':
+        raise click.UsageError('--in_memory only applies to Financial_Report workbooks (--source xlsx).')
+
+    date_range = _search_date_range(search_type, date_from, date_to, date_field)
+
+    edgar_db = EdgarDatabase(years=_range_shard_years(date_range, date_field))
     edgar_db.make_session()
 
-    search_results = _searcher(search_type, edgar_db, print_results=False)
+    print(f"Prepping filings. Looking for forms of type {', '.join(VALID_FORMS)} for parsing...")
+
+    # only unattempted filings of a valid form are fetched -- the filtering happens in the query
+    filters = filing_filters(date_range, date_field, forms=VALID_FORMS, unattempted=True)
+    search_results = _searcher(search_type, edgar_db, print_results=False, filters=filters, date_field=date_field)
     print('\n')
 
     filings_to_download = []
     filings_to_parse = []
     parsing_successes = 0
-    valid_results = 0
 
-    print(f"Prepping filings. Looking for forms of type {', '.join(VALID_FORMS)} for parsing...")
-    for filing in search_results:
-        if filing.FilingInfo.form not in VALID_FORMS:
-            continue
-
-        valid_results += 1
+    held_back = 0
+    now = int(time.time())
 
-        if filing.FilingInfo.parsing_attempted:
+    for filing in search_results:
+        # negative cache -- an earlier download failed, so leave the filing alone until its retry-after time
+        if not filing.FilingInfo.excel_path and (filing.FilingInfo.download_retry_after or 0) > now:
+            held_back += 1
             continue
 
         filings_to_parse.append(filing)
@@ -175,88 +244,59 @@ def parse_filings(search_type, csv=False):
 
         filings_to_download.append(filing)
 
-    if filings_to_download:
-        print('\n')
-        print('Downloading {} filings...'.format(len(filings_to_download)))
-
-        if len(filings_to_download) > 20:  # multiprocess this if there are a significant number of filings to dl
-            filing_download_pool = multiprocessing.Pool(processes=MULTIPROCESSING_NUMBER)
-            filings_to_record = filing_download_pool.map(_download_xlsxs, filings_to_download)
-            filing_download_pool.close()
-            filings_to_record = flatten(filings_to_record)
-        else:
-            filings_to_record = _download_xlsxs(filings_to_download)
-
-        for f in filings_to_record:
-            for r in edgar_db.session.query(FilingInfo).filter(FilingInfo.excel_url == f[1]).all():
-                r.excel_path = f[0]
-
-    edgar_db.session.commit()
-
-    print('\n')
-    print('Download complete.')
-    print('\n')
-
-    # reload filing objects from database as Excel write paths have been updated
-    filings_to_parse = edgar_db.select_filings_by_accessions([f.FilingInfo.filing_accession for f in filings_to_parse])
+    if held_back:
+        print(f'{held_back} filings skipped as their last download failed (see download_retry_after).')
 
-    parsing_errors = []
-    with click.progressbar(label=f'Parsing {len(filings_to_parse)} filings...', length=len(filings_to_parse)) as bar:
-
-        for filing in filings_to_parse:
+    if enqueue:
+        # hand the candidates to `secparse worker` processes rather than parsing them here
+        job_queue = ParseJobQueue(queue_db)
+        queued = job_queue.enqueue([f.FilingInfo.filing_accession for f in filings_to_parse])
+        print(f'{queued} filings added to the parse queue ({len(filings_to_parse) - queued} already queued).')
+        edgar_db.close_session()
+        return search_results
 
-            if not filing.FilingInfo.excel_path:
-                continue
+    if pipeline or in_memory:
+        print('\n')
+        print(f'Downloading {len(filings_to_download)} filings while parsing...')
+        parsing_successes, parsing_errors = _download_and_parse_pipelined(filings_to_parse, filings_to_download,
+                                                                          edgar_db, source, in_memory)
+    else:
+        if filings_to_download:
+            print('\n')
+            print('Downloading {} filings...'.format(len(filings_to_download)))
+            _download_and_record(filings_to_download, edgar_db, source)
 
-            new_filing_bs_dfs = _build_filing_dfs(
-                filing.FilingInfo.excel_path,
-                re_search_terms=r'\bcond.*?\bconsol.*?\bbalance|\bbalance.*?\bsheet'
-            )
+        edgar_db.session.commit()
 
-            new_filing_pl_dfs = _build_filing_dfs(
-                filing.FilingInfo.excel_path,
-                re_search_terms=r'\boper|\bcond.*?\bconso'
-            )
+        print('\n')
+        print('Download complete.')
+        print('\n')
 
-            if not new_filing_bs_dfs:
-                pass
-            else:
-                for filing_bs_df in new_filing_bs_dfs:
-                    clean_filing_bs_data = _clean_data_file(filing_bs_df, r'\bbalance.*?\bsheet', r'.?')
-
-                    # write filing data to db if parsing returns something
-                    if clean_filing_bs_data is None:
-                        parsing_errors.append('BS: ' + str(filing.FilingInfo.excel_path))
-                    else:
-                        edgar_db.set_filing_data(filing, clean_filing_bs_data, filing_type='BS')
-                        parsing_successes += 1
-
-            if not new_filing_pl_dfs:
-                pass
-            else:
-                for filing_pl_df in new_filing_pl_dfs:
-                    clean_filing_pl_data = _clean_data_file(filing_pl_df, r'\boperatio|\brevenue', '12 months')
+        # reload filing objects from database as Excel write paths have been updated
+        filings_to_parse = edgar_db.select_filings_by_accessions([f.FilingInfo.filing_accession
+                                                                  for f in filings_to_parse])
 
-                    # write filing data to db if parsing returns something
-                    if clean_filing_pl_data is None:
-                        parsing_errors.append('PL: ' + str(filing.FilingInfo.excel_path))
-                        continue
+        parsing_errors = []
+        with click.progressbar(label=f'Parsing {len(filings_to_parse)} filings...',
+                               length=len(filings_to_parse)) as bar:
 
-                    if edgar_db.set_filing_data(filing, clean_filing_pl_data, filing_type='PL') is not False:
-                        parsing_successes += 1
-                    else:
-                        parsing_errors.append('PL: ' + str(filing.FilingInfo.excel_path))
+            for filing in filings_to_parse:
+                filing_successes, filing_errors = _parse_filing(filing, edgar_db)
+                parsing_successes += filing_successes
+                parsing_errors.extend(filing_errors)
 
-            bar.update(1)
+                bar.update(1)
 
     print('\n')
     print('Parsing complete.')
-    print('Total valid filings:', valid_results)
+    print('Total unparsed filings:', len(search_results))
     print('Successful sheet parses:', parsing_successes)
     print('Unsuccessful sheet parses:', len(parsing_errors))
 
-    for c in edgar_db.select_filings_by_url([f.FilingInfo.filing_url for f in filings_to_parse]):
-        c.FilingInfo.parsing_attempted = True
+    # filings that couldn't be downloaded stay unattempted, so they're picked up again once their retry-after passes.
+    # A workbook parsed from memory has no excel_path, but its checksum shows it was downloaded
+    edgar_db.mark_parsing_attempted([f.FilingInfo for f in filings_to_parse
+                                     if f.FilingInfo.excel_path or f.FilingInfo.excel_checksum])
 
     error_log_loc = normalize_file_path('unsuccessful_parses.txt')
 
@@ -266,17 +306,7 @@ def parse_filings(search_type, csv=False):
     print('Unsuccessful parse log written to:', error_log_loc)
 
     if csv:
-        # generate a DataFrame via SQL query for all parsed values in the data table
-        sic_df = pd.read_sql_table(DB_SIC_TABLE, edgar_db.db_eng)
-        company_df = pd.read_sql_table(DB_COMPANY_TABLE, edgar_db.db_eng)
-        filing_info_df = pd.read_sql_table(DB_FILING_TABLE, edgar_db.db_eng,
-                                           parse_dates={'period': '%Y%m%d', 'filed': '%Y%m%d'})
-        filing_data_df = pd.read_sql_table(DB_FILING_DATA_TABLE, edgar_db.db_eng,
-                                           parse_dates={'value_period': '%Y%m%d'})
-
-        little_data_df = pd.merge(filing_data_df, filing_info_df, how='left')
-        some_data_df = pd.merge(little_data_df, company_df, how='left')
-        all_data_df = pd.merge(some_data_df, sic_df, how='left', left_on='company_sic', right_on='sic_code')
+        all_data_df = edgar_db.parsed_data_frame()
 
         print('\n')
         print(all_data_df.head())
@@ -293,6 +323,39 @@ def parse_filings(search_type, csv=False):
     return search_results
 
 
+@cli.command()
+@click.argument('index_paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--all_forms', default=False, is_flag=True, help='Import every form type, not just those that are '
+                                                               'parsed.')
+def import_index(index_paths, all_forms):
+    """
+    Bulk-loads filing information from Edgar full-index files (form.idx / master.idx, optionally gzipped) on local
+    disk. Accepts files or folders, e.g. a mirror of https://www.sec.gov/Archives/edgar/full-index/. Run
+    update_company_info afterwards to fill in company details.
+    """
+
+    index_files = find_index_files(index_paths)
+
+    if not index_files:
+        print('No form.idx / master.idx files found.')
+        sys.exit(0)
+
+    edgar_db = EdgarDatabase()
+
+    start = time.time()
+    records_read = {}
+
+    with click.progressbar(index_files, label=f'Importing {len(index_files)} index files...') as bar:
+        for index_file in bar:
+            records_read.update(import_index_files(edgar_db.db_eng, [index_file],
+                                                   forms=None if all_forms else VALID_FORMS,
+                                                   shard_router=edgar_db.shard_router))
+
+    print('\n')
+    print(f'{sum(records_read.values())} filing records read in {time.time() - start:.0f} seconds '
+          f'(existing filings are left unchanged).')
+
+
 @cli.command()
 def update_company_info():
     """Attempts to download information for all company CIKs without an associated ticker."""
@@ -300,15 +363,94 @@ def update_company_info():
     edgar_db = EdgarDatabase()
     edgar_db.make_session()
 
-    to_update_ciks = edgar_db.session.query(
+    # includes stubs loaded by import_index, which have a name but no SIC code yet
+    to_update_ciks = [r[0] for r in edgar_db.session.query(
         distinct(CompanyInfo.company_cik)).filter(and_(
-            CompanyInfo.company_name.is_(None),
-            CompanyInfo.company_info_attempted.is_(False))).all()
+            or_(CompanyInfo.company_name.is_(None), CompanyInfo.company_sic.is_(None)),
+            CompanyInfo.company_info_attempted.is_(False))).all()]
 
     _update_company_info(to_update_ciks, edgar_db)
     edgar_db.close_session()
 
 
+@cli.command()
+@click.option('--map_file', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='Ticker mapping file: SEC\'s company_tickers.json, or a CSV of ticker,name[,cik] rows. Defaults to '
+                   'TICKER_MAP_FILE, which is downloaded from SEC if missing.')
+@click.option('--download', default=False, is_flag=True, help='Download a fresh copy of SEC\'s ticker mapping first.')
+def resolve_tickers(map_file, download):
+    """Fills in missing tickers for stored companies from a local ticker / name mapping file, without API calls."""
+
+    if map_file is None:
+        map_file = TICKER_MAP_FILE
+
+        if download or not map_file.exists():
+            response = http_session().get(TICKER_MAP_URL)
+            if response.status_code != 200:
+                print(f"Can't download the ticker mapping (HTTP {response.status_code}).")
+                sys.exit(0)
+            map_file.write_bytes(response.content)
+
+    start = time.time()
+    resolver = load_resolver(map_file)
+    print(f'{len(resolver)} companies in ticker mapping, loaded in {time.time() - start:.1f} seconds.')
+
+    edgar_db = EdgarDatabase()
+    edgar_db.make_session()
+
+    companies = edgar_db.session.query(CompanyInfo).filter(CompanyInfo.company_ticker.is_(None)).all()
+
+    start = time.time()
+    misses = resolver.resolve_companies(companies)
+    elapsed = max(time.time() - start, 1e-6)
+
+    edgar_db.close_session()
+
+    print(f'{len(companies) - len(misses)} of {len(companies)} companies without a ticker resolved '
+          f'({len(companies) / elapsed:.0f} per second).')
+
+
+@cli.command()
+def shard_database():
+    """
+    Splits filing information and parsed data out of the main database into one SQLite file per filing year. Set
+    DB_SHARDED in config.py afterwards to use the sharded layout.
+    """
+
+    start = time.time()
+    moved = move_filings_to_shards()
+
+    if not moved:
+        print('No unsharded filings found.')
+        sys.exit(0)
+
+    for year, filings in moved.items():
+        print(f'{year}: {filings} filings')
+
+    print(f'\n{sum(moved.values())} filings moved to {DB_SHARD_DIR} in {time.time() - start:.0f} seconds.')
+
+    if not DB_SHARDED:
+        print('Set DB_SHARDED = True in config.py to start using them.')
+
+
+@cli.command()
+@click.option('--rebuild', default=False, is_flag=True, help='Recompute the summary tables from every parsed filing.')
+def refresh_summaries(rebuild):
+    """
+    Updates the summary tables (latest balance sheets, term coverage, SIC medians) read by EdgarDatabase's
+    latest_balance_sheet, term_coverage and summary_sic_medians. Parsing keeps them current, so this is only needed
+    with --rebuild, e.g. for a database parsed before the tables existed.
+    """
+    edgar_db = EdgarDatabase()
+    edgar_db.make_session()
+
+    start = time.time()
+    edgar_db.refresh_summaries(rebuild=rebuild)
+    edgar_db.close_session()
+
+    print(f'Summary tables refreshed in {time.time() - start:.1f} seconds.')
+
+
 @cli.command()
 def clear_parsed_files():
     """Deletes any downloaded Excel files that have been successfully parsed."""
@@ -320,8 +462,11 @@ def clear_parsed_files():
 
     for parsed_excel in parsed_excel_paths:
         try:
-            os.remove(parsed_excel.excel_path)
-        except FileNotFoundError:
+            if os.path.isdir(parsed_excel.excel_path):  # FilingSummary downloads are stored as a folder of reports
+                shutil.rmtree(parsed_excel.excel_path)
+            else:
+                os.remove(parsed_excel.excel_path)
+        except (FileNotFoundError, TypeError):
             pass
 
         for c in edgar_db.session.query(FilingInfo).filter(
@@ -333,11 +478,453 @@ def clear_parsed_files():
     print(f'{len(parsed_excel_paths)} files deleted.')
 
 
-def _searcher(search_type, edgar_db, print_results=True):
-    """Prints any downloaded filing information associated with companies within search scope."""
+@cli.command()
+@click.option('--since-version', 'since_version', default=PARSER_VERSION, type=int,
+              help='Reparse filings parsed by a parser version older than this. Defaults to the current version.')
+@click.option('--source', type=click.Choice(['xlsx', 'summary']), default='xlsx',
+              help='Where to pull statements from for filings whose downloads have been cleared.')
+def reparse(since_version, source):
+    """
+    Reparses filings parsed under older parsing rules, or whose previous parse failed. Filings that failed under the
+    current rules are skipped if their workbook hasn't changed since.
+    """
+
+    edgar_db = EdgarDatabase()
+    edgar_db.make_session()
+
+    candidates = edgar_db.select_filings_to_reparse(since_version)
+    print(f'{len(candidates)} filings parsed before version {since_version} or unsuccessfully parsed.')
+
+    # workbooks removed by clear_parsed_files need downloading again
+    filings_to_download = [f for f in candidates
+                           if not f.FilingInfo.excel_path or not os.path.exists(f.FilingInfo.excel_path)]
+    if filings_to_download:
+        print(f'Downloading {len(filings_to_download)} filings...')
+        _download_and_record(filings_to_download, edgar_db, source)
+
+    reparsed = 0
+    unchanged = 0
+    missing = 0
+    parsing_successes = 0
+    parsing_errors = []
+
+    candidates = edgar_db.select_filings_by_accessions([f.FilingInfo.filing_accession for f in candidates])
+
+    with click.progressbar(label=f'Reparsing {len(candidates)} filings...', length=len(candidates)) as bar:
+        for filing in candidates:
+            bar.update(1)
+
+            # a download that failed above, or a workbook moved / deleted since it was recorded
+            if not filing.FilingInfo.excel_path or not os.path.exists(filing.FilingInfo.excel_path):
+                missing += 1
+                continue
+
+            # same workbook, same rules -- parsing again would only reproduce the last result
+            if (filing.FilingInfo.parser_version is not None and filing.FilingInfo.parser_version >= PARSER_VERSION
+                    and filing.FilingInfo.workbook_hash == content_hash(filing.FilingInfo.excel_path)):
+                unchanged += 1
+                continue
+
+            edgar_db.delete_filing_data(filing.FilingInfo.filing_accession)
+
+            filing_successes, filing_errors = _parse_filing(filing, edgar_db)
+            parsing_successes += filing_successes
+            parsing_errors.extend(filing_errors)
+            reparsed += 1
+
+            edgar_db.session.commit()
+
+    print('\n')
+    print('Reparsing complete.')
+    print('Filings reparsed:', reparsed)
+    print('Filings skipped as unchanged:', unchanged)
+    print('Filings skipped with no workbook on disk:', missing)
+    print('Successful sheet parses:', parsing_successes)
+    print('Unsuccessful sheet parses:', len(parsing_errors))
+
+    edgar_db.close_session()
+
+
+@cli.command()
+@click.option('--terms', prompt='Accounting terms (comma separated)', help='Accounting terms to include, e.g. '
+                                                                          '"Revenues, Net Income".')
+@click.option('--filing_type', default=None, help='Only include values from this statement type, e.g. PL or BS.')
+@click.option('--sparse', default=False, is_flag=True, help='Write only stored values (COO format) rather than a '
+                                                            'dense array.')
+@click.option('--out_dir', default=None, type=click.Path(file_okay=False),
+              help='Folder to write the panel to. Defaults to a timestamped folder in the data directory.')
+def export_panel(terms, filing_type, sparse, out_dir):
+    """
+    Exports parsed values as a companies x periods x terms float32 array in memory-mapped .npy files, with index maps
+    alongside. Load with secparse.panel.load_panel.
+    """
+
+    terms = [term.strip() for term in terms.split(',') if term.strip()]
+
+    if out_dir is None:
+        out_dir = normalize_file_path('panel_{}'.format(dt.datetime.now().strftime('%Y%m%d%H%M%S')))
+
+    edgar_db = EdgarDatabase()
+
+    panel_dir = build_panel(edgar_db.db_eng, terms, out_dir, filing_type=filing_type, sparse=sparse)
+
+    with open(panel_dir.joinpath('index.json')) as f:
+        index = json.load(f)
+
+    print(f"{index['values']} values written for {index['shape'][0]} companies, {index['shape'][1]} periods and "
+          f"{index['shape'][2]} terms.")
+    print('Panel written to:', panel_dir)
+
+
+@cli.command()
+@click.option('--scales', default='0.01,0.1,1', help='Comma separated scale factors -- 1 is roughly 1,000 companies '
+                                                     'and 6-7M parsed values.')
+@click.option('--repeat', default=3, help='Times to run each operation (the median is reported).')
+@click.option('--keep_db', default=False, is_flag=True, help='Keep the generated databases.')
+@click.option('--out', default=None, type=click.Path(dir_okay=False), help='Write timings to this JSON file.')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='Earlier --out file to compare timings against.')
+def benchmark(scales, repeat, keep_db, out, baseline):
+    """
+    Times database operations against synthetic databases of increasing size, to see how they scale. Your own
+    database is not touched.
+    """
+
+    scales = sorted(float(scale) for scale in scales.split(',') if scale.strip())
+    results = run_benchmarks(scales, repeat=repeat, keep_db=keep_db)
+    exponents = scaling_exponents(results)
+
+    print('\n')
+    print('Operation'.ljust(40), *[f'x{scale:g}'.rjust(10) for scale in scales], 'Scaling'.rjust(8), sep=' | ')
+    print('-' * (54 + 13 * len(scales)))
+
+    for operation in results[scales[-1]]['seconds']:
+        exponent = exponents.get(operation)
+        print(operation[:40].ljust(40),
+              *[f"{results[scale]['seconds'].get(operation, float('nan')):.4f}".rjust(10) for scale in scales],
+              (f'{exponent:.2f}' if exponent is not None else '').rjust(8), sep=' | ')
+
+    print('\nTimes are median seconds. Scaling is k in time ~ rows^k between the smallest and largest scale.')
+
+    if baseline:
+        print('\nChange against baseline (above 1 is slower):')
+        for operation, ratio in compare_to_baseline(results, baseline).items():
+            print(operation[:60].ljust(60), f'{ratio:.2f}', '<-- regression' if ratio > 1.2 else '', sep=' | ')
+
+    if out:
+        print('\nTimings written to:', save_results(results, out))
+
+
+@cli.command()
+@click.option('--queue_db', default=None, type=click.Path(dir_okay=False),
+              help='Shared SQLite file holding the parse queue. Defaults to the main database.')
+@click.option('--source', type=click.Choice(['xlsx', 'summary']), default='xlsx',
+              help='Where to pull statements from for filings not yet downloaded.')
+@click.option('--batch_size', default=QUEUE_BATCH_SIZE, help='Number of filings to claim at a time.')
+@click.option('--wait/--no-wait', default=False, help='Keep polling for new jobs once the queue is empty.')
+def worker(queue_db, source, batch_size, wait):
+    """
+    Claims batches of filings from the parse queue (filled by parse_filings --enqueue), downloads and parses them.
+    Run on as many machines as needed -- claims are leased, so a crashed worker's filings are picked up by others.
+    """
+
+    worker_id = f'{platform.node()}-{os.getpid()}'
+    job_queue = ParseJobQueue(queue_db)
+
+    edgar_db = EdgarDatabase()
+    edgar_db.make_session()
+
+    # renew our leases in the background so long batches aren't reclaimed while still being worked on
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_lease_heartbeat, args=(job_queue, worker_id, stop_heartbeat), daemon=True)
+    heartbeat.start()
+
+    parsing_successes = 0
+    parsing_errors = []
+
+    print(f'Worker {worker_id} started.')
+
+    try:
+        while True:
+            accessions = job_queue.claim(worker_id, batch_size)
+
+            if not accessions:
+                if not wait:
+                    break
+                time.sleep(QUEUE_POLL_SECONDS)
+                continue
+
+            print(f'Claimed {len(accessions)} filings...')
+
+            # a failed write (e.g. "database is locked") costs the filings it touched an attempt, not the worker
+            try:
+                parsing_successes += _worker_batch(accessions, edgar_db, job_queue, worker_id, source, parsing_errors)
+            except SQLAlchemyError as err:
+                edgar_db.session.rollback()
+                job_queue.retry(worker_id)
+                print('Batch failed:', err)
+
+    except KeyboardInterrupt:
+        print('\nStopping worker...')
+
+    finally:
+        stop_heartbeat.set()
+        job_queue.release(worker_id)  # hand back anything still claimed so it doesn't wait out the lease
+        edgar_db.close_session()
+
+    print('Successful sheet parses:', parsing_successes)
+    print('Unsuccessful sheet parses:', len(parsing_errors))
+    print('Queue status:', ', '.join(f'{status}: {count}' for status, count in job_queue.status_counts().items()))
+
+
+@cli.command('writer')
+def run_writer():
+    """
+    Runs the single-writer service. Other secparse commands send their database writes here while it runs, and
+    writes arriving together are committed together, so concurrent commands don't fail with "database is locked".
+    Stop with Ctrl-C or SIGTERM.
+    """
+
+    if DB_SHARDED:
+        print('The writer service is for unsharded databases -- sharded filings are written by each command.')
+        sys.exit(0)
+
+    stop_event = threading.Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(stop_signal, lambda *_: stop_event.set())
+
+    try:
+        server = WriterServer(GroupCommitWriter(DB_FILE_LOC, Base.metadata), WRITER_ADDRESS)
+    except OSError as err:
+        print(f"Can't listen on {WRITER_ADDRESS[0]}:{WRITER_ADDRESS[1]} ({err}). Is a writer already running?")
+        sys.exit(1)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Writer listening on {WRITER_ADDRESS[0]}:{WRITER_ADDRESS[1]}. Press Ctrl-C to stop.')
+
+    stop_event.wait()
+
+    print('\nShutting down...')
+    server.close()
+
+    stats = server.writer.stats
+    print(f"{stats['batches']} write batches ({stats['rows']} rows) committed in {stats['commits']} commits.")
+    if stats['failed_batches']:
+        print(f"{stats['failed_batches']} batches failed.")
+
+
+def _worker_batch(accessions, edgar_db, job_queue, worker_id, source, parsing_errors) -> int:
+    """Downloads and parses a batch of claimed filings, completing each job. Returns number of sheets stored"""
+    parsing_successes = 0
+
+    filings_to_download = [f for f in edgar_db.select_filings_by_accessions(accessions) if not f.FilingInfo.excel_path]
+    if filings_to_download:
+        _download_and_record(filings_to_download, edgar_db, source)
+
+    for filing in edgar_db.select_filings_by_accessions(accessions):
+        accession = filing.FilingInfo.filing_accession
+
+        # lease may have expired and been handed to another worker -- leave the filing to them
+        if not job_queue.holds_lease(worker_id, accession):
+            continue
+
+        try:
+            filing_successes, filing_errors = _parse_filing(filing, edgar_db)
+
+            if filing.FilingInfo.excel_path:
+                edgar_db.mark_parsing_attempted([filing.FilingInfo])
+        except SQLAlchemyError as err:
+            edgar_db.session.rollback()
+            job_queue.retry(worker_id, [accession])
+            print('Write failed:', accession, err)
+            continue
+
+        parsing_successes += filing_successes
+        parsing_errors.extend(filing_errors)
+
+        if filing.FilingInfo.excel_path:
+            job_queue.complete(worker_id, accession, succeeded=filing_successes > 0)
+        else:
+            # download failed -- back on the queue once its retry-after passes, as parse_filings would
+            job_queue.complete(worker_id, accession, succeeded=False,
+                               retry_after=filing.FilingInfo.download_retry_after
+                               or int(time.time()) + NEGATIVE_CACHE_RETRY_SECONDS)
+
+    edgar_db.refresh_summaries()
+
+    return parsing_successes
+
+
+def _lease_heartbeat(job_queue, worker_id, stop_event):
+    """Extends a worker's leases every third of a lease period until told to stop"""
+    while not stop_event.wait(QUEUE_LEASE_SECONDS / 3):
+        job_queue.heartbeat(worker_id)
+
+
+@cli.command()
+@click.option('--interval', default=WATCH_INTERVAL_SECONDS, help='Seconds between polls of the Edgar filing feed.')
+@click.option('--port', default=WATCH_HEALTH_PORT, help='Port serving /health and /metrics (0 to disable).')
+@click.option('--source', type=click.Choice(['xlsx', 'summary']), default='xlsx',
+              help='Where to pull statements from for new filings.')
+@click.option('--get_company_info/--no-get_company_info', default=True,
+              help='Attempt to find additional information about companies that have filed.')
+def watch(interval, port, source, get_company_info):
+    """
+    Runs continuously, polling Edgar's filing feed and downloading / parsing new filings as they appear. Keeps its
+    HTTP connections and database open between polls. Stop with Ctrl-C or SIGTERM.
+    """
+
+    stop_event = threading.Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(stop_signal, lambda *_: stop_event.set())
+
+    metrics = WatchMetrics(interval)
+    health_server = start_health_server(metrics, port) if port else None
+
+    # one pool for company info lookups and downloads, kept warm between polls
+    pool = multiprocessing.Pool(processes=MULTIPROCESSING_NUMBER)
+
+    edgar_db = EdgarDatabase()
+    edgar_db.make_session()
+
+    feed_cache = {}
+    seen_accessions = RecentSet(WATCH_SEEN_ACCESSIONS)
+
+    print(f'Watching for new filings every {interval} seconds. Press Ctrl-C to stop.')
+    if health_server:
+        print(f'Health and metrics served on http://localhost:{port}.')
+
+    while not stop_event.is_set():
+        try:
+            _watch_poll(edgar_db, feed_cache, seen_accessions, metrics, source, get_company_info, pool)
+            metrics.record_poll()
+        except (rq.RequestException, SSLError, MaxRetryError, SQLAlchemyError) as err:
+            edgar_db.session.rollback()
+            metrics.record_error(err)
+            print('Poll failed:', err)
+
+        stop_event.wait(interval)
+
+    print('\nShutting down...')
+
+    if health_server:
+        health_server.shutdown()
+    pool.close()
+    edgar_db.close_session()
+
+
+def _watch_poll(edgar_db, feed_cache, seen_accessions, metrics, source='xlsx', get_company_info=True, pool=None):
+    """
+    Ingests filings new since the last poll, then downloads and parses those of a valid form type. The feeds' ETags
+    and the accessions seen are only saved once the poll succeeds, so a failed poll's filings are picked up by the next.
+    """
+
+    # check last month's feed too so filings made just before a month rolls over aren't missed -- unchanged feeds cost
+    # a single conditional request
+    this_month = dt.date.today().replace(day=1)
+    last_month = this_month - dt.timedelta(days=1)
+
+    new_entries = {}
+    fetched = {}
+    for month_start in (last_month, this_month):
+        feed = _fetch_feed(month_start.year, month_start.month, feed_cache, fetched)
+
+        if feed is None:
+            continue
+
+        for item in feed.entries:
+            if item['edgar_accessionnumber'] not in seen_accessions:
+                new_entries[item['edgar_accessionnumber']] = item
+
+    if new_entries:
+        _watch_ingest(edgar_db, list(new_entries.values()), metrics, source, get_company_info, pool)
+
+    seen_accessions.update(new_entries)
+    feed_cache.update(fetched)
+
+
+def _watch_ingest(edgar_db, new_entries, metrics, source='xlsx', get_company_info=True, pool=None):
+    """
+    Stores feed entries, then downloads and parses any of a valid form type not yet attempted.
+
+    :param pool: process pool to look up company info and download with, rather than starting one for this poll
+    """
+    new_accessions = _update_filings(new_entries, get_company_info, edgar_db, pool)
+    metrics.increment('filings_ingested', len(new_accessions))
+
+    # not just the filings inserted now -- entries stored by an earlier poll that failed part way are still to parse
+    now = int(time.time())
+    filings_to_parse = [f for f in edgar_db.select_filings_by_accessions([i['edgar_accessionnumber']
+                                                                         for i in new_entries])
+                        if f.FilingInfo.form in VALID_FORMS and not f.FilingInfo.parsing_attempted
+                        and (f.FilingInfo.download_retry_after or 0) <= now]
+
+    if not filings_to_parse:
+        return
+
+    _download_and_record(filings_to_parse, edgar_db, source, pool)
+
+    for filing in edgar_db.select_filings_by_accessions([f.FilingInfo.filing_accession for f in filings_to_parse]):
+        filing_successes, _ = _parse_filing(filing, edgar_db)
+        if filing.FilingInfo.excel_path:
+            edgar_db.mark_parsing_attempted([filing.FilingInfo])
+
+        metrics.increment('filings_parsed')
+        metrics.increment('sheets_parsed', filing_successes)
+
+    edgar_db.refresh_summaries()
+
+
+def _option_date_range(date_from, date_to):
+    """(from, to) datetimes for the --from / --to options, or None if neither was given"""
+    if not date_from and not date_to:
+        return None
+
+    for param_hint, value in (('--from', date_from), ('--to', date_to)):
+        try:
+            if value:
+                dateutil.parser.parse(value)
+        except (ValueError, OverflowError):
+            raise click.BadParameter(f"can't read {value!r} as a date, e.g. 2018-01-01", param_hint=param_hint)
+
+    return user_date_range([date_from or '', date_to or ''])
+
 
-    if search_type == 'all':
-        search_results = edgar_db.select_all_filings()
+def _search_date_range(search_type, date_from, date_to, date_field='filed'):
+    """
+    The --from / --to range, or for the date search type without them, a range asked for now -- before the database
+    is opened, so a sharded database attaches the years it covers
+    """
+    date_range = _option_date_range(date_from, date_to)
+
+    if search_type == 'date' and date_range is None:
+        print(f'Enter a date range for the filing {date_field} date (leave blank for no limit):')
+        date_range = user_date_range()
+
+    return date_range
+
+
+def _range_shard_years(date_range, date_field='filed'):
+    """years_for_range, refused with a usage error where a sharded database couldn't attach them all"""
+    years = years_for_range(date_range, date_field)
+
+    if DB_SHARDED and years and len(years) > MAX_ATTACHED_SHARDS:
+        raise click.UsageError(f'That date range covers {len(years)} years of filings, but at most '
+                               f'{MAX_ATTACHED_SHARDS} can be searched at once. Narrow it with --from / --to.')
+
+    return years
+
+
+def _searcher(search_type, edgar_db, print_results=True, filters=(), date_field='filed'):
+    """
+    Prints any downloaded filing information associated with companies within search scope.
+
+    :param filters: further SQL predicates for the filings returned, e.g. from filing_filters -- for the date search
+    type, these hold the range from _search_date_range
+    """
+
+    if search_type in ('all', 'date'):
+        search_results = edgar_db.select_all_filings(filters)
     else:
         search_term = click.prompt('Please enter search term')
 
@@ -354,7 +941,7 @@ def _searcher(search_type, edgar_db, print_results=True):
             ciks_to_parse = edgar_db.select_ciks_by_ticker(search_term)
 
         # for cik number matches get list of company-filing objects
-        search_results = edgar_db.select_filings_by_ciks(ciks_to_parse)
+        search_results = edgar_db.select_filings_by_ciks(ciks_to_parse, filters)
 
     if print_results:
         print('\nResults:\n')
@@ -362,10 +949,7 @@ def _searcher(search_type, edgar_db, print_results=True):
         print('-' * 100)
 
         for result in search_results:
-            try:
-                period = dt.datetime.strftime(dt.datetime.strptime(str(result.FilingInfo.period), '%Y%m%d'), '%m/%d/%Y')
-            except ValueError:
-                period = ''
+            period = display_date(result.FilingInfo.period)
             company_name = result.CompanyInfo.company_name
             if company_name is None:
                 company_name = ''
@@ -380,19 +964,218 @@ def _searcher(search_type, edgar_db, print_results=True):
     return search_results
 
 
-def _download_filings(year, month, print_data=True):
-    """Downloads list of filings from SEC's Edgar database for given time period."""
-    print('\nDownloading filings XML...\n')
+def _download_and_record(filings_to_download, edgar_db, source='xlsx', pool=None):
+    """
+    Downloads statement data for a list of filings and records where each was written. Failed downloads are put in
+    the negative cache so they aren't retried before their retry-after time.
+
+    :param pool: process pool to download with, if there's one to hand -- otherwise one is started if it's worth it
+    """
+
+    download_func = _download_summary_reports if source == 'summary' else _download_xlsxs
+
+    if pool is not None:
+        filings_to_record = flatten(pool.map(download_func, filings_to_download))
+    elif len(filings_to_download) > 20:  # multiprocess this if there are a significant number of filings to dl
+        filing_download_pool = multiprocessing.Pool(processes=MULTIPROCESSING_NUMBER)
+        filings_to_record = filing_download_pool.map(download_func, filings_to_download)
+        filing_download_pool.close()
+        filings_to_record = flatten(filings_to_record)
+    else:
+        filings_to_record = download_func(filings_to_download)
+
+    for download in filings_to_record:
+        if download.failure is None:
+            edgar_db.record_download(download.excel_url, download.path, download.size, download.checksum)
+        else:
+            edgar_db.record_download_failure(download.excel_url, missing=download.failure == DOWNLOAD_MISSING)
+
+    edgar_db.session.commit()
+
+
+def _download_and_parse_pipelined(filings_to_parse, filings_to_download, edgar_db, source='xlsx',
+                                  in_memory=False) -> (int, List[str]):
+    """
+    Overlaps downloading and parsing. Downloads run in a process pool and each finished one is put on a queue that
+    this thread parses from straight away -- filings already on disk are parsed while waiting for downloads.
+
+    At most PIPELINE_MAX_IN_FLIGHT filings are downloading or waiting to be parsed at once, so downloads can't run
+    far ahead of parsing and fill the disk (or, in_memory, memory). Database writes all happen on this thread.
+
+    :param in_memory: download workbooks into memory and parse them from there -- nothing is written to xlsx_data/
+
+    :return: (successful sheet parses, parse error messages)
+    """
+    if in_memory:
+        download_func = _fetch_xlsxs
+    else:
+        download_func = _download_summary_reports if source == 'summary' else _download_xlsxs
+
+    filings_by_url = {f.FilingInfo.excel_url: f for f in filings_to_download}
+    downloaded = queue.Queue(maxsize=PIPELINE_MAX_IN_FLIGHT)
+    in_flight = threading.BoundedSemaphore(PIPELINE_MAX_IN_FLIGHT)
+
+    def submit_downloads(pool):
+        for filing in filings_to_download:
+            in_flight.acquire()  # blocks while the parser is PIPELINE_MAX_IN_FLIGHT filings behind
+            pool.apply_async(download_func, ([filing], ), callback=downloaded.put, error_callback=downloaded.put)
+
+    ready = [f for f in filings_to_parse if f.FilingInfo.excel_path]
+    downloads_left = len(filings_to_download)
+    parsing_successes = 0
+    parsing_errors = []
+
+    download_pool = multiprocessing.Pool(processes=min(MULTIPROCESSING_NUMBER, max(downloads_left, 1)))
+    threading.Thread(target=submit_downloads, args=(download_pool, ), daemon=True).start()
+
+    with click.progressbar(label=f'Parsing {len(filings_to_parse)} filings...', length=len(filings_to_parse)) as bar:
+        while downloads_left or ready:
+            try:
+                # only wait on downloads when there's nothing already on disk to parse
+                results = downloaded.get(block=not ready)
+            except queue.Empty:
+                results = None
+
+            if results is None:
+                filing = ready.pop()
+            else:
+                downloads_left -= 1
+                in_flight.release()
+
+                if isinstance(results, Exception):
+                    print('\nDownload error:', results)
+                    bar.update(1)
+                    continue
+
+                download = results[0]
+                filing = filings_by_url[download.excel_url]
+
+                if download.failure is not None:
+                    edgar_db.record_download_failure(download.excel_url, missing=download.failure == DOWNLOAD_MISSING)
+                    edgar_db.session.commit()
+                    bar.update(1)
+                    continue
+
+                # updates filing in place -- it's the same object the session loaded
+                edgar_db.record_download(download.excel_url, download.path, download.size, download.checksum)
+                edgar_db.session.commit()
+
+            # an in-memory workbook is dropped once parsed, when results is replaced by the next download
+            filing_successes, filing_errors = _parse_filing(filing, edgar_db,
+                                                            workbook=results[0].content if results else None)
+            parsing_successes += filing_successes
+            parsing_errors.extend(filing_errors)
+            bar.update(1)
+
+    download_pool.close()
+    download_pool.join()
+
+    return parsing_successes, parsing_errors
+
+
+def _parse_filing(filing, edgar_db, workbook: Optional[bytes] = None) -> (int, List[str]):
+    """
+    Classifies and stores every statement sheet in a filing's downloaded data.
+
+    :param workbook: the filing's workbook, if it was downloaded to memory -- otherwise it's read from excel_path
+    :return: number of sheets stored, list of sheets that couldn't be parsed
+    """
+
+    successes = 0
+    errors = []
+
+    if not filing.FilingInfo.excel_path and workbook is None:
+        return successes, errors
+
+    source_name = filing.FilingInfo.excel_path or filing.FilingInfo.excel_url
+
+    # every candidate sheet is read once and classified from its header in a single pass
+    new_filing_dfs = _build_filing_dfs(workbook if workbook is not None else filing.FilingInfo.excel_path,
+                                       re_search_terms=SHEET_NAME_RE)
+
+    for filing_df in new_filing_dfs or []:
+        sheet_match = classify_sheet(filing_df)
+
+        if sheet_match is None:
+            continue
 
+        clean_filing_data = _clean_data_file(filing_df, sheet_match)
+
+        # write filing data to db if parsing returns something
+        if clean_filing_data is None:
+            errors.append(f'{sheet_match.filing_type}: {source_name}')
+            continue
+
+        if edgar_db.set_filing_data(filing, clean_filing_data, filing_type=sheet_match.filing_type) is not False:
+            successes += 1
+        else:
+            errors.append(f'{sheet_match.filing_type}: {source_name}')
+
+    # the checksum taken while downloading saves reading the workbook a second time
+    try:
+        workbook_hash = filing.FilingInfo.excel_checksum or content_hash(filing.FilingInfo.excel_path)
+    except (FileNotFoundError, NotADirectoryError, TypeError):
+        workbook_hash = None
+
+    # the sheets are stored either way -- without the stamp, reparse just treats the filing as parsed by older rules
+    try:
+        edgar_db.record_parse(filing.FilingInfo.filing_accession, workbook_hash)
+    except WriteError as err:
+        print('Unable to record parse:', source_name, f'({err})')
+
+    return successes, errors
+
+
+def _fetch_feed(year, month, feed_cache=None, fetched=None) -> Optional[feedparser.FeedParserDict]:
+    """
+    Fetches and parses Edgar's monthly XBRL filing feed over the shared HTTP session.
+
+    :param feed_cache: dict kept between calls -- if given, the feed is only re-downloaded when Edgar reports it has
+    changed (ETag / Last-Modified), and None is returned when it hasn't. Any other response but a 200 raises
+    requests.HTTPError, and its validators aren't kept
+    :param fetched: if given, the new feed's ETag / Last-Modified go here rather than into feed_cache, for the caller
+    to save once it has dealt with the feed
+    """
     edgar_url = ('http://www.sec.gov/Archives/edgar/monthly/xbrlrss-' + str(year).zfill(4) +
                  '-' + str(month).zfill(2) + '.xml')
 
+    headers = {}
+    validators = feed_cache.get(edgar_url, {}) if feed_cache is not None else {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    response = http_session().get(edgar_url, headers=headers, timeout=60)
+
+    if response.status_code == 304:
+        return None
+
+    # an error page (e.g. Edgar's 403 when rate limiting) would parse as an empty feed
+    if response.status_code != 200:
+        raise rq.HTTPError(f'HTTP {response.status_code} fetching {edgar_url}', response=response)
+
+    saved_validators = fetched if fetched is not None else feed_cache
+    if saved_validators is not None:
+        saved_validators[edgar_url] = {'etag': response.headers.get('ETag'),
+                                       'last_modified': response.headers.get('Last-Modified')}
+
+    # use feedparser rss xml parser to enable selection by tag
+    return feedparser.parse(response.content)
+
+
+def _download_filings(year, month, print_data=True):
+    """Downloads list of filings from SEC's Edgar database for given time period."""
+    print('\nDownloading filings XML...\n')
+
     try:
-        # use feedparser rss xml parser to enable selection by tag
-        rss_data = feedparser.parse(edgar_url)
-    except (ConnectionError, TimeoutError, SSLError, MaxRetryError):
+        rss_data = _fetch_feed(year, month)
+    except (rq.ConnectionError, rq.Timeout, ConnectionError, TimeoutError, SSLError, MaxRetryError):
         print("Can't connect.")
         return None
+    except rq.HTTPError as err:
+        print("Can't download the filing feed:", err)
+        return None
 
     if print_data:
         print(rss_data['feed']['title'] + ':', '\n')
@@ -404,20 +1187,185 @@ def _download_filings(year, month, print_data=True):
             name = re.sub("[^a-zA-Z ]+", "", item['edgar_companyname']).replace("  ", " ").title()
             cik = item['edgar_ciknumber']
             form = item['edgar_formtype']
-            try:
-                # try to pretty-print filing period date
-                period = dt.datetime.strftime(dt.datetime.strptime(item['edgar_period'], '%Y%m%d'), '%m/%d/%Y')
-            except KeyError:
-                period = ''
+            # try to pretty-print filing period date
+            period = display_date(item.get('edgar_period', ''))
 
             print(name[:30].ljust(30), cik.ljust(10), period.ljust(10), form.ljust(10), sep=' | ')
 
     return rss_data.entries
 
 
-def _download_xlsxs(filings) -> list((str, FilingInfo.excel_url)):
+def _check_workbook_bytes(content: bytes, size: int) -> Optional[str]:
+    """Reason downloaded content isn't an Excel workbook (by size and magic bytes), or None if it looks like one"""
+    if size < MIN_WORKBOOK_BYTES:
+        return f'only {size} bytes'
+
+    if not content.startswith(WORKBOOK_MAGIC):
+        return 'not an Excel file'
+
+    return None
+
+
+def _check_download_response(response) -> Optional[str]:
+    """Reason a response can't be used -- error status or an HTML page (e.g. Edgar's throttling notice) -- or None"""
+    if response.status_code not in (200, 206):
+        return f'HTTP {response.status_code}'
+
+    if 'html' in response.headers.get('Content-Type', ''):
+        return 'HTML page returned'
+
+    return None
+
+
+def _stream_workbook(url: str, write_path: Path) -> (Optional[str], Optional[str], int, Optional[str]):
+    """
+    Streams a workbook to <write_path>.part, renaming it into place only once complete and validated, so write_path
+    never holds a partial file. A .part file left by an interrupted download is resumed with an HTTP Range request,
+    conditional (If-Range) on the ETag / Last-Modified saved alongside it -- if the file has changed since, the server
+    sends it whole and the download starts again.
+
+    :return: (problem, failure kind, size, sha256) -- problem is None on success
+    """
+    part_path = write_path.with_name(write_path.name + '.part')
+    validator_path = write_path.with_name(write_path.name + '.part.validator')
+
+    # a .part without a validator can't be checked against the server's copy, so isn't resumed
+    offset = part_path.stat().st_size if part_path.exists() and validator_path.exists() else 0
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator_path.read_text()} if offset else None
+
+    response = http_session().get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+    if response.status_code == 416:  # .part no longer matches what the server has -- start again
+        response.close()
+        part_path.unlink()
+        offset = 0
+        response = http_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+    with response:
+        problem = _check_download_response(response)
+
+        if problem is not None:
+            failure = DOWNLOAD_MISSING if response.status_code in (404, 410) else DOWNLOAD_FAILED
+            return problem, failure, 0, None
+
+        sha = hashlib.sha256()
+
+        if response.status_code == 206:
+            # resuming -- the checksum has to cover the bytes already on disk too
+            with open(part_path, 'rb') as part:
+                for chunk in iter(lambda: part.read(DOWNLOAD_CHUNK_BYTES), b''):
+                    sha.update(chunk)
+        else:
+            offset = 0  # server sent the whole file
+
+            # weak ETags can't be used with If-Range, so fall back to Last-Modified
+            etag = response.headers.get('ETag')
+            validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+
+            if validator:
+                validator_path.write_text(validator)
+            elif validator_path.exists():
+                validator_path.unlink()
+
+        size = offset
+        with open(part_path, 'ab' if offset else 'wb') as part:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                size += len(chunk)
+
+                if size > MAX_WORKBOOK_BYTES:
+                    part.close()
+                    _remove_part(part_path, validator_path)
+                    return f'larger than {MAX_WORKBOOK_BYTES} bytes', DOWNLOAD_MISSING, size, None
+
+                part.write(chunk)
+                sha.update(chunk)
+
+    with open(part_path, 'rb') as part:
+        problem = _check_workbook_bytes(part.read(8), size)
+
+    if problem is not None:
+        _remove_part(part_path, validator_path)
+        return problem, DOWNLOAD_FAILED, size, None
+
+    os.replace(part_path, write_path)
+    if validator_path.exists():
+        validator_path.unlink()
+
+    return None, None, size, sha.hexdigest()
+
+
+def _remove_part(part_path: Path, validator_path: Path):
+    for path in (part_path, validator_path):
+        if path.exists():
+            path.unlink()
+
+
+def _fetch_workbook(url: str) -> (Optional[str], Optional[str], Optional[bytearray], Optional[str]):
+    """
+    Downloads a workbook into memory, with the same checks as _stream_workbook.
+
+    :return: (problem, failure kind, workbook buffer, sha256) -- problem is None on success
+    """
+    with http_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        problem = _check_download_response(response)
+
+        if problem is not None:
+            failure = DOWNLOAD_MISSING if response.status_code in (404, 410) else DOWNLOAD_FAILED
+            return problem, failure, None, None
+
+        content = bytearray()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+            content += chunk
+
+            if len(content) > MAX_WORKBOOK_BYTES:
+                return f'larger than {MAX_WORKBOOK_BYTES} bytes', DOWNLOAD_MISSING, None, None
+
+    problem = _check_workbook_bytes(bytes(content[:8]), len(content))
+
+    if problem is not None:
+        return problem, DOWNLOAD_FAILED, None, None
+
+    # the buffer itself is handed on -- bytes(content) would hold a second copy of the workbook
+    return None, None, content, hashlib.sha256(content).hexdigest()
+
+
+def _fetch_xlsxs(filings) -> List[DownloadResult]:
+    """
+    Like _download_xlsxs, but keeps each workbook in memory (DownloadResult.content) rather than writing it to disk.
+    """
+
+    fetched = []
+
+    if type(filings) != list:
+        filings = [filings]
+
+    for f in filings:
+        time.sleep(.2)
+        try:
+            problem, failure, content, checksum = _fetch_workbook(f.FilingInfo.excel_url)
+
+        except (rq.Timeout, rq.ConnectionError, rq.ConnectTimeout, rq.exceptions.ChunkedEncodingError, SSLError,
+                MaxRetryError):
+            print('Unsuccessful:', f.FilingInfo.excel_url)
+            fetched.append(DownloadResult(None, f.FilingInfo.excel_url, DOWNLOAD_FAILED, None, None))
+            continue
+
+        if problem is not None:
+            print('Unsuccessful:', f.FilingInfo.excel_url, f'({problem})')
+            fetched.append(DownloadResult(None, f.FilingInfo.excel_url, failure, None, None))
+            continue
+
+        fetched.append(DownloadResult(None, f.FilingInfo.excel_url, None, len(content), checksum, content))
+
+    return fetched
+
+
+def _download_xlsxs(filings) -> List[DownloadResult]:
     """
     Download XLSX files for a list of urls.
+
+    :return: a DownloadResult per filing -- failure is None when the download succeeded, otherwise path is None and
+    failure is DOWNLOAD_MISSING (no usable workbook exists) or DOWNLOAD_FAILED (may succeed on retry)
     """
 
     path_update_list = []
@@ -434,37 +1382,208 @@ def _download_xlsxs(filings) -> list((str, FilingInfo.excel_url)):
                                              f.FilingInfo.filing_accession +
                                              '.xlsx')
 
-            if not write_path.exists():
-                filing_excel = rq.get(f.FilingInfo.excel_url)
-                write_path.write_bytes(filing_excel.content)
+            # don't trust a file already on disk if it isn't a workbook (e.g. an error page saved by an older version)
+            if write_path.exists():
+                with open(write_path, 'rb') as existing:
+                    if _check_workbook_bytes(existing.read(8), write_path.stat().st_size) is not None:
+                        write_path.unlink()
+
+            if write_path.exists():
+                path_update_list.append(DownloadResult(str(write_path), f.FilingInfo.excel_url, None,
+                                                       write_path.stat().st_size, content_hash(write_path)))
+                continue
+
+            problem, failure, size, checksum = _stream_workbook(f.FilingInfo.excel_url, write_path)
+
+            if problem is not None:
+                print('Unsuccessful:', f.FilingInfo.excel_url, f'({problem})')
+                path_update_list.append(DownloadResult(None, f.FilingInfo.excel_url, failure, None, None))
+                continue
+
+            path_update_list.append(DownloadResult(str(write_path), f.FilingInfo.excel_url, None, size, checksum))
+
+        except (FileNotFoundError, rq.Timeout, rq.ConnectionError, rq.ConnectTimeout,
+                rq.exceptions.ChunkedEncodingError, SSLError, MaxRetryError):
+            # whatever was streamed before the error stays in the .part file for the next attempt to resume from
+            print('Unsuccessful:', f.FilingInfo.excel_url)
+            path_update_list.append(DownloadResult(None, f.FilingInfo.excel_url, DOWNLOAD_FAILED, None, None))
+            continue
+
+    return path_update_list
+
+
+def _select_summary_reports(filing_summary: bs4.BeautifulSoup) -> List[tuple]:
+    """
+    Picks the balance sheet, income statement and cash flow reports out of a parsed FilingSummary.xml.
+
+    :return: list of (ShortName, HtmlFileName) tuples for the statements worth downloading
+    """
+    reports = []
+
+    # html.parser lower-cases tag names, so FilingSummary's <MenuCategory> etc. are matched in lower case
+    for report in filing_summary.find_all('report'):
+        category = report.find('menucategory')
+        short_name = report.find('shortname')
+        file_name = report.find('htmlfilename')
+
+        if category is None or short_name is None or file_name is None:
+            continue
+
+        if category.text.strip().lower() != 'statements':
+            continue
+
+        short_name = short_name.text.strip()
+
+        if classify_title(short_name) is not None:
+            reports.append((short_name, file_name.text.strip()))
+
+    return reports
+
+
+def _download_summary_reports(filings) -> List[DownloadResult]:
+    """
+    Download only the BS / P&L / cash flow R-files listed in each filing's FilingSummary.xml, rather than the full
+    Financial_Report workbook. Reports are stored in a folder per filing, each file named for its report ShortName.
+
+    :return: a DownloadResult per filing, as for _download_xlsxs
+    """
+
+    path_update_list = []
+
+    if type(filings) != list:
+        filings = [filings]
+
+    for f in filings:
+        time.sleep(.2)
+        try:
+
+            # folder name will be the cik plus accession numbers
+            write_dir = normalize_file_path('xlsx_data/' + f.FilingInfo.company_cik + '_' +
+                                            f.FilingInfo.filing_accession)
+
+            if not write_dir.exists():
+                # FilingSummary.xml sits in the same archive folder as Financial_Report.xlsx
+                base_url = f.FilingInfo.excel_url.rsplit('/', 1)[0]
+                summary_response = http_session().get(base_url + '/FilingSummary.xml', timeout=DOWNLOAD_TIMEOUT)
+
+                if summary_response.status_code != 200:
+                    print('Unsuccessful:', base_url, f'(HTTP {summary_response.status_code})')
+                    failure = DOWNLOAD_MISSING if summary_response.status_code in (404, 410) else DOWNLOAD_FAILED
+                    path_update_list.append(DownloadResult(None, f.FilingInfo.excel_url, failure, None, None))
+                    continue
+
+                reports = _select_summary_reports(bs4.BeautifulSoup(summary_response.content, 'html.parser'))
+
+                if not reports:
+                    print('No statements found:', base_url)
+                    path_update_list.append(DownloadResult(None, f.FilingInfo.excel_url, DOWNLOAD_MISSING, None, None))
+                    continue
+
+                report_responses = [(short_name, http_session().get(base_url + '/' + file_name,
+                                                                    timeout=DOWNLOAD_TIMEOUT))
+                                    for short_name, file_name in reports]
+                failed_reports = [r for _, r in report_responses if r.status_code != 200]
+
+                if failed_reports:
+                    print('Unsuccessful:', base_url, f'(HTTP {failed_reports[0].status_code})')
+                    path_update_list.append(DownloadResult(None, f.FilingInfo.excel_url, DOWNLOAD_FAILED, None, None))
+                    continue
+
+                # write to a temporary folder and rename it into place, so write_dir never holds a partial set
+                part_dir = write_dir.with_name(write_dir.name + '.part')
+                shutil.rmtree(part_dir, ignore_errors=True)
+                part_dir.mkdir()
+
+                for i, (short_name, response) in enumerate(report_responses):
+                    part_dir.joinpath(f'{i}_' + re.sub('[^a-zA-Z0-9]+', '_', short_name).strip('_') +
+                                      '.htm').write_bytes(response.content)
 
-            path_update_list.append((str(write_path), f.FilingInfo.excel_url))
+                os.replace(part_dir, write_dir)
+
+            path_update_list.append(DownloadResult(str(write_dir), f.FilingInfo.excel_url, None,
+                                                   sum(p.stat().st_size for p in write_dir.iterdir()),
+                                                   content_hash(write_dir)))
 
         except (FileNotFoundError, rq.Timeout, rq.ConnectionError, rq.ConnectTimeout, SSLError, MaxRetryError):
             print('Unsuccessful:', f.FilingInfo.excel_url)
+            path_update_list.append(DownloadResult(None, f.FilingInfo.excel_url, DOWNLOAD_FAILED, None, None))
             continue
 
     return path_update_list
 
 
-def _build_filing_dfs(file_path: str, re_search_terms: str) -> Union[None, List[pd.DataFrame]]:
+def _report_cell_value(text: str):
+    """Converts an R-file cell to a float where it holds a number, e.g. '$ (1,234)' -> -1234.0"""
+    if not text:
+        return None
+
+    num_text = text.replace('$', '').replace(',', '').strip()
+
+    try:
+        if num_text.startswith('(') and num_text.endswith(')'):
+            return -float(num_text.strip('() '))
+        return float(num_text)
+    except ValueError:
+        return text
+
+
+def _read_report_table(report_path: Path) -> pd.DataFrame:
+    """
+    Reads a FilingSummary R-file into the same layout as a Financial_Report sheet -- spanned header cells keep their
+    value in the first cell and leave the rest blank, as merged cells do in Excel.
+    """
+    report = bs4.BeautifulSoup(report_path.read_bytes(), 'html.parser')
+    table = report.find('table', class_='report') or report.find('table')
+
+    if table is None:
+        return pd.DataFrame()
+
+    rows = []
+    covered = {}  # column number -> number of rows below still covered by a rowspan cell
+
+    for tr in table.find_all('tr'):
+        row = []
+
+        for cell in tr.find_all(['th', 'td']):
+            while covered.get(len(row)):
+                covered[len(row)] -= 1
+                row.append(None)
+
+            col_span = int(cell.get('colspan', 1))
+            row_span = int(cell.get('rowspan', 1))
+
+            if row_span > 1:
+                for col_num in range(len(row), len(row) + col_span):
+                    covered[col_num] = row_span - 1
+
+            row.append(_report_cell_value(cell.get_text(' ', strip=True)))
+            row.extend([None] * (col_span - 1))
+
+        rows.append(row)
+
+    return pd.DataFrame(rows).dropna(how='all')
+
+
+def _build_filing_dfs(file_path: Union[str, bytes], re_search_terms: str) -> Union[None, List[pd.DataFrame]]:
 
     if not file_path:
         return None
 
     return_dfs = []
 
-    if file_path.split(".")[-1] == 'xls' or 'xlsx':
-        try:
-            excel = pd.ExcelFile(file_path)
-        except (FileNotFoundError, XLRDError):
-            return None
+    if isinstance(file_path, (bytes, bytearray, memoryview)):
+        # workbook downloaded straight into memory (parse_filings --in_memory) -- read in place, not copied
+        with io.BufferedReader(BufferReader(file_path)) as workbook:
+            return _workbook_dfs(workbook, re_search_terms)
 
-        for sheet_name in excel.sheet_names:
-            if re.search(re_search_terms, sheet_name, flags=re.IGNORECASE):
-                return_dfs.append(excel.parse(sheet_name, header=None).dropna(how='all'))
+    if Path(file_path).is_dir():
+        # FilingSummary reports -- match on the report ShortName each file is named for
+        for report_path in sorted(Path(file_path).glob('*.htm')):
+            if re.search(re_search_terms, report_path.stem.replace('_', ' '), flags=re.IGNORECASE):
+                return_dfs.append(_read_report_table(report_path))
 
-        excel.close()
+    elif file_path.split(".")[-1] == 'xls' or 'xlsx':
+        return _workbook_dfs(file_path, re_search_terms)
 
     elif file_path.split(".")[-1] == 'csv':
 
@@ -484,28 +1603,30 @@ def _build_filing_dfs(file_path: str, re_search_terms: str) -> Union[None, List[
     return return_dfs
 
 
-def _clean_data_file(df: pd.DataFrame, re_search_filing_type: str, re_search_period: str) -> Optional[ndarray]:
-    if type(df) is None:
+def _workbook_dfs(workbook, re_search_terms: str) -> Optional[List[pd.DataFrame]]:
+    """Sheets of a workbook (a path or file-like object) whose names match re_search_terms"""
+    try:
+        excel = pd.ExcelFile(workbook)
+    except (FileNotFoundError, XLRDError):
         return None
 
-    header_vals_list = [str(item) for item in flatten(df.iloc[:5, :].values.tolist())]
-    header_vals_string = ' '.join([str(val) for val in header_vals_list])
+    return_dfs = [excel.parse(sheet_name, header=None).dropna(how='all') for sheet_name in excel.sheet_names
+                  if re.search(re_search_terms, sheet_name, flags=re.IGNORECASE)]
 
-    # unit correction to 1 USD
-    if re.search('thousands|Thousands', header_vals_string):
-        unit_multiplier = 1000
-    elif re.search('millions|Millions', header_vals_string):
-        unit_multiplier = 1000000
-    elif re.search('billions|Billions', header_vals_string):
-        unit_multiplier = 1000000000
-    else:
-        unit_multiplier = 1
+    excel.close()
+
+    return return_dfs
 
-    # confirm sheet type by looking at header values for relevant string pattern
-    if re.search(re_search_filing_type, header_vals_string, flags=re.IGNORECASE) is None:
+
+def _clean_data_file(df: pd.DataFrame, sheet_match: SheetMatch) -> Optional[ndarray]:
+    if df is None or sheet_match is None:
         return None
 
-    if re.search(re_search_period, header_vals_string, flags=re.IGNORECASE) is None:
+    # keep only the columns for the period we're storing, so dates don't repeat across e.g. 3 and 9 month columns
+    if sheet_match.period_months is not None:
+        df = select_period(df, sheet_match.period_months)
+
+    if df.shape[1] < 2:
         return None
 
     dropped_df = df.dropna(how='any', subset=df.columns[1:])
@@ -515,7 +1636,7 @@ def _clean_data_file(df: pd.DataFrame, re_search_filing_type: str, re_search_per
                                      .replace('$', '').strip().title())
 
     for col in cleaned_df.columns[1:]:
-        cleaned_df.loc[1:, col] = cleaned_df.loc[1:, col].apply(scale_array_val, args=(unit_multiplier,))
+        cleaned_df.loc[1:, col] = cleaned_df.loc[1:, col].apply(scale_array_val, args=(sheet_match.unit_multiplier,))
 
     final_df = cleaned_df.dropna()
     final_df = final_df.drop_duplicates(subset=[0], keep=False, inplace=False)
@@ -530,25 +1651,41 @@ def _get_single_company_info(company_cik):
 
     company_info.company_cik = company_cik
 
-    company_info = api_cik_to_info(company_info)
+    # tickers are resolved afterwards in one batch -- see _resolve_tickers
+    return api_cik_to_info(company_info)
 
-    if company_info.company_name:
-        company_info = api_name_to_ticker(company_info)
 
-    return company_info
+def _resolve_tickers(companies: List[CompanyInfo], pool=None):
+    """
+    Looks up tickers in the local mapping file (TICKER_MAP_FILE). The web APIs are only tried for companies it can't
+    resolve, and only if RESOLVER_NETWORK_FALLBACK is set -- or there's no mapping file to use.
+    """
+    resolver = load_resolver()
+    misses = resolver.resolve_companies(companies) if resolver is not None else list(companies)
+    misses = [c for c in misses if c.company_name]
 
+    if not misses or not (RESOLVER_NETWORK_FALLBACK or resolver is None):
+        return
 
-def _update_filings(rss_data, get_company_info):
+    # results come back as copies from the pool, so copy the tickers across
+    resolved = pool.map(api_name_to_ticker, misses) if pool is not None else [api_name_to_ticker(c) for c in misses]
+    for company, resolved_company in zip(misses, resolved):
+        company.company_ticker = resolved_company.company_ticker
+
+
+def _update_filings(rss_data, get_company_info, edgar_db, pool=None) -> List[str]:
     """
-    Parse and store filing data defined by Edgar's filing feed (via a parsed XML file)
+    Parse and store filing data defined by Edgar's filing feed (via a parsed XML file). Returns the accession numbers
+    of filings that weren't already in the database.
+
+    :param pool: process pool to look up company info with -- one is started for the call if not given
     """
     print('\nUpdating filings...')
 
-    edgar_db = EdgarDatabase()
-    edgar_db.make_session()
-
     duplicates = 0
     company_ciks_to_download = []
+    new_accessions = set()
+    new_filings = []
 
     with click.progressbar(length=len(rss_data), label=f'Adding {len(rss_data)} new items to database...') as bar:
         for i, item in enumerate(rss_data):
@@ -567,63 +1704,70 @@ def _update_filings(rss_data, get_company_info):
             if edgar_db.check_cik_exists(cik) is False:
                 company_ciks_to_download.append(cik)
 
-            # if db search for filing returns a hit, skip writing that filing
-            if edgar_db.check_accession_exists(accession) is True:
+            # if db search for filing returns a hit (or the feed lists it twice), skip writing that filing
+            if accession in new_accessions or edgar_db.check_accession_exists(accession) is True:
                 duplicates += 1
             else:
-                edgar_db.insert_objects(FilingInfo(
+                new_accessions.add(accession)
+                new_filings.append(FilingInfo(
                     company_cik=cik,
                     filing_accession=accession,
                     form=str(item['edgar_formtype']).strip(),
                     period=period,
                     filed=str(item['edgar_acceptancedatetime']).strip(),
                     filing_url=filing_url,
-                    excel_url='http://www.sec.gov/Archives/edgar/data/' + cik.lstrip("0") + '/' +
-                              accession.replace("-", "") + '/Financial_Report.xlsx',
+                    excel_url=filing_excel_url(cik, accession),
                     excel_path=None,
                     parsed_data=False))
 
+    # written in one batch, rather than holding a write transaction open while the feed is read
+    edgar_db.insert_objects(new_filings)
+
     # show user if we skipped writing any entries because they were already in database
     if duplicates > 0:
         print(f'{duplicates} duplicate entries skipped...')
 
     if len(company_ciks_to_download) > 0 and get_company_info:
-        _update_company_info(company_ciks_to_download, edgar_db)
+        _update_company_info(company_ciks_to_download, edgar_db, pool)
 
-    edgar_db.close_session()
+    return [f.filing_accession for f in new_filings]
 
 
-def _update_company_info(company_ciks_to_download, edgar_db):
-    """Attempt to download info about a given company's CIK"""
+def _update_company_info(company_ciks_to_download, edgar_db, pool=None):
+    """Attempt to download info about a given company's CIK, using pool if given rather than starting one"""
+    if not company_ciks_to_download:
+        return
+
     print('\n')
     print('Updating company info...')
 
     print(f'Collecting info for {len(company_ciks_to_download)} companies...')
-    company_download_pool = multiprocessing.Pool(processes=MULTIPROCESSING_NUMBER)
+    company_download_pool = pool if pool is not None else multiprocessing.Pool(processes=MULTIPROCESSING_NUMBER)
     info_to_insert = company_download_pool.map(_get_single_company_info, list(set(company_ciks_to_download)))
-    company_download_pool.close()
+    _resolve_tickers(info_to_insert, company_download_pool)
+
+    if pool is None:
+        company_download_pool.close()
 
-    edgar_db.insert_objects(info_to_insert)
+    for company in info_to_insert:
+        company.company_info_attempted = True
 
-    for c in edgar_db.select_filings_by_ciks(company_ciks_to_download):
-        c.CompanyInfo.company_info_attempted = True
+    # some of these companies may already have a row (e.g. stubs from import_index) -- fill them in rather than clash
+    edgar_db.merge_objects(info_to_insert)
 
     print('Done.')
     print("\n")
 
 
-def _build_sic_table():
-
-    edgar_db = EdgarDatabase()
-    edgar_db.make_session()
+def _build_sic_table(edgar_db):
 
     if edgar_db.session.query(func.count(SicInfo.sic_code)).first()[0] != 0:
         return True
 
     try:
-        sic_tables = bs4.BeautifulSoup(rq.get('https://www.sec.gov/info/edgar/siccodes.htm').content, 'html.parser')
+        sic_tables = bs4.BeautifulSoup(http_session().get('https://www.sec.gov/info/edgar/siccodes.htm').content,
+                                       'html.parser')
     except (ConnectionError, TimeoutError, SSLError, MaxRetryError):
-        edgar_db.close_session()
         print("Can't connect.")
         sys.exit(0)
 
@@ -633,9 +1777,8 @@ def _build_sic_table():
     sic_df.columns = ['sic_code', 'ad_office', 'drop', 'industry_title']
     sic_df = sic_df.drop('drop', axis='columns')
 
-    sic_df.to_sql(DB_SIC_TABLE, edgar_db.db_eng, if_exists='replace', index=False)
-
-    edgar_db.close_session()  # need to use session logic to commit changes
+    edgar_db.merge_objects([SicInfo(sic_code=str(row.sic_code), ad_office=row.ad_office,
+                                    industry_title=row.industry_title) for row in sic_df.itertuples()])
 
 
 if __name__ == '__main__':
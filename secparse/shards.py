@@ -0,0 +1,169 @@
+import datetime as dt
+from typing import List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import object_session
+from sqlalchemy.sql.util import find_tables
+
+from .config import *
+
+# filing tables are split into one SQLite file per filing year -- everything else stays in the main database
+SHARDED_TABLES = [DB_FILING_TABLE, DB_FILING_DATA_TABLE]
+MAIN_SHARD = 'main'
+
+# SQLite's default SQLITE_MAX_ATTACHED -- a connection can't see more shards than this at once
+MAX_ATTACHED_SHARDS = 10
+
+
+def filing_year(filed) -> Optional[int]:
+    """Shard year of a filing, from its %Y%m%d%H%M%S filed value"""
+    if filed is None:
+        return None
+    return int(str(filed)[:4])
+
+
+def shard_path(year) -> Path:
+    return DB_SHARD_DIR.joinpath(f'filings_{year}.sqlite3')
+
+
+def shard_years_on_disk() -> List[int]:
+    return sorted(int(p.stem.split('_')[1]) for p in DB_SHARD_DIR.glob('filings_*.sqlite3'))
+
+
+def default_shard_years() -> List[int]:
+    """The most recent MAX_ATTACHED_SHARDS years"""
+    this_year = dt.datetime.now().year
+    return list(range(this_year - MAX_ATTACHED_SHARDS + 1, this_year + 1))
+
+
+def years_for_range(date_range=None, date_field='filed') -> Optional[List[int]]:
+    """
+    Shards to attach for a search date range (as from user_date_range) -- the range's years that have a shard on disk,
+    or None for the default years. A reporting period is filed in the same year or the one after, so period ranges
+    take in the following year too.
+    """
+    if date_range is None:
+        return None
+
+    range_min, range_max = date_range
+    last_year = range_max.year + (1 if date_field == 'period' else 0)
+
+    # no shards in the range -- the date filter finds nothing whichever years are attached
+    return [year for year in shard_years_on_disk() if range_min.year <= year <= last_year] or None
+
+
+def attach_shards(dbapi_conn, years):
+    """
+    ATTACHes the given year shards to a raw SQLite connection and shadows the filing tables with TEMP views that
+    UNION ALL across them, so plain SQL (e.g. panel exports, pandas reads) sees one filing_info / filing_data table.
+    """
+    for year in years:
+        dbapi_conn.execute(f"ATTACH DATABASE '{shard_path(year)}' AS y{year}")
+
+    for table in SHARDED_TABLES:
+        union = ' UNION ALL '.join(f'SELECT * FROM y{year}.{table}' for year in years)
+        dbapi_conn.execute(f'CREATE TEMP VIEW {table} AS {union}')
+
+
+class ShardRouter(object):
+    """
+    Chooses shards for a ShardedSession: filing rows go to the shard for their filing year, company / SIC rows to
+    the main database. Queries that touch the filing tables are run against every shard in `years`.
+
+    Shard connections ATTACH the main database, so a filing query can still join company_info.
+    """
+
+    def __init__(self, main_engine, years, create_tables):
+        self.main_engine = main_engine
+        self.years = list(years)
+        self.engines = {}
+        self._create_tables = create_tables
+        self._accession_years = {}
+
+        # the latest year always gets a shard, so new filings have somewhere to go and the views are never empty
+        for year in self.years:
+            if shard_path(year).exists() or year == max(self.years):
+                self.engine(year)
+
+    def engine(self, year):
+        """Engine for a year's shard, creating the shard file and tables on first use"""
+        if year not in self.engines:
+            DB_SHARD_DIR.mkdir(parents=True, exist_ok=True)
+            engine = create_engine(f'sqlite:///{shard_path(year)}', echo=False)
+
+            # WAL, so analyst reads of a shard don't block writes to it
+            engine.execute('PRAGMA journal_mode = WAL')
+            self._create_tables(engine)
+
+            # attached only once the shard's own tables exist, so they can't be confused with the main database's
+            @event.listens_for(engine, 'connect')
+            def attach_main(dbapi_conn, _):
+                dbapi_conn.execute(f"ATTACH DATABASE '{DB_FILE_LOC}' AS edgar_main")
+
+            self.engines[year] = engine
+
+        return self.engines[year]
+
+    def shards(self) -> dict:
+        return {MAIN_SHARD: self.main_engine, **self.engines}
+
+    def filing_shards(self) -> List[int]:
+        """Years being queried that have a shard"""
+        return [year for year in self.years if year in self.engines]
+
+    def _year_for_accession(self, accession):
+        if accession not in self._accession_years:
+            for year, engine in self.engines.items():
+                if engine.execute(f'SELECT 1 FROM {DB_FILING_TABLE} WHERE filing_accession = ?',
+                                  accession).first():
+                    self._accession_years[accession] = year
+                    break
+
+        return self._accession_years.get(accession)
+
+    def shard_chooser(self, mapper, instance, clause=None):
+        table = mapper.local_table.name
+
+        if table == DB_FILING_TABLE:
+            year = filing_year(instance.filed)
+            self._accession_years[instance.filing_accession] = year
+        elif table == DB_FILING_DATA_TABLE:
+            year = self._year_for_accession(instance.filing_accession)
+        else:
+            return MAIN_SHARD
+
+        if year is None:
+            raise ValueError(f'No filing year to shard {instance.filing_accession} by')
+
+        if year not in self.engines:
+            # a year outside those being queried -- still written, just not visible to this instance's reads
+            object_session(instance).bind_shard(year, self.engine(year))
+
+        return year
+
+    def row_shard(self, table, row: dict):
+        """Shard for a row written as a plain dict (see EdgarDatabase._write), chosen as shard_chooser would"""
+        if table == DB_FILING_TABLE:
+            year = filing_year(row.get('filed')) or self._year_for_accession(row['filing_accession'])
+            if year is not None:
+                self._accession_years[row['filing_accession']] = year  # its data is routed before this commits
+        elif table == DB_FILING_DATA_TABLE:
+            year = self._year_for_accession(row['filing_accession'])
+        else:
+            return MAIN_SHARD
+
+        if year is None:
+            raise ValueError(f"No filing year to shard {row['filing_accession']} by")
+
+        return year
+
+    def id_chooser(self, query, ident):
+        return self.query_chooser(query)
+
+    def query_chooser(self, query):
+        tables = {t.name for t in find_tables(query.statement)}
+
+        if tables.intersection(SHARDED_TABLES):
+            return self.filing_shards()
+
+        return [MAIN_SHARD]
@@ -1,6 +1,10 @@
 import datetime as dt
 import dateutil.parser
+import hashlib
+import io
+import os
 import re
+import requests
 from numpy import nan
 
 from .config import *
@@ -31,6 +35,77 @@ def make_folders():
         pass
 
 
+_http_session = None
+_http_session_pid = None
+
+
+def http_session() -> requests.Session:
+    """
+    Returns this process's shared HTTP session, so repeated requests to Edgar reuse warm connections. A forked process
+    (e.g. a multiprocessing pool worker) gets a session of its own rather than sharing its parent's sockets.
+    """
+    global _http_session, _http_session_pid
+
+    if _http_session is None or _http_session_pid != os.getpid():
+        _http_session = requests.Session()
+        _http_session_pid = os.getpid()
+
+    return _http_session
+
+
+def filing_excel_url(cik, accession) -> str:
+    """Location of a filing's Financial_Report workbook in the Edgar archive"""
+    return 'http://www.sec.gov/Archives/edgar/data/' + cik.lstrip("0") + '/' + accession.replace("-", "") + \
+           '/Financial_Report.xlsx'
+
+
+def content_hash(file_path) -> str:
+    """SHA-256 of a downloaded workbook -- or, for a folder of FilingSummary reports, of every report in it"""
+    file_path = Path(file_path)
+    sha = hashlib.sha256()
+
+    report_paths = sorted(file_path.iterdir()) if file_path.is_dir() else [file_path]
+
+    for report_path in report_paths:
+        with open(report_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file over a bytes-like buffer that reads straight from it -- io.BytesIO copies a bytearray"""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        size = max(min(len(target), len(self._view) - self._position), 0)
+        target[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(start + offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
 def flatten(deep_list):
     return [item for sublist in deep_list for item in sublist]
 
@@ -76,21 +151,19 @@ def user_date_range(dates_to_parse=None):
     """
 
     if dates_to_parse:
-        while True:
-            # assume that dates_to_parse is a list containing 2 values
-            date_from = dates_to_parse[0].strip()
-            date_to = dates_to_parse[1].strip()
-            try:
-                # use dateutil to try and extract datetime from string
-                range_min = dateutil.parser.parse(date_from) if date_from else dt.datetime.min
-                range_max = dateutil.parser.parse(date_to) if date_to else dt.datetime.now()
-
-            # if dates can't be parsed will continue to next loop, which prompts user to enter new dates
-            except ValueError:
-                print('Incorrect date format. Please try again.\n')
-                continue
+        # assume that dates_to_parse is a list containing 2 values
+        date_from = dates_to_parse[0].strip()
+        date_to = dates_to_parse[1].strip()
+        try:
+            # use dateutil to try and extract datetime from string
+            range_min = dateutil.parser.parse(date_from) if date_from else dt.datetime.min
+            range_max = dateutil.parser.parse(date_to) if date_to else dt.datetime.now()
             return range_min, range_max
 
+        # if dates can't be parsed fall through to the prompt below, so the user can enter new dates
+        except ValueError:
+            print('Incorrect date format. Please try again.\n')
+
     # prompt user for dates if object isn't handed to function
     while True:
         date_from = input('Start: ')
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class WatchMetrics(object):
+    """Thread-safe counters for the watch daemon, read by the health endpoint"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.time()
+        self.last_poll = None
+        self.last_error = None
+        self.counters = {'polls': 0, 'poll_errors': 0, 'filings_ingested': 0, 'filings_parsed': 0, 'sheets_parsed': 0}
+        self._lock = threading.Lock()
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def record_poll(self):
+        with self._lock:
+            self.counters['polls'] += 1
+            self.last_poll = time.time()
+
+    def record_error(self, err):
+        with self._lock:
+            self.counters['poll_errors'] += 1
+            self.last_error = f'{type(err).__name__}: {err}'
+
+    def healthy(self) -> bool:
+        """Healthy while polls keep succeeding -- allows a couple of missed intervals before reporting a problem"""
+        last_ok = self.last_poll or self.started
+        return time.time() - last_ok < self.interval * 3
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'status': 'ok' if self.healthy() else 'stale', 'uptime_seconds': int(time.time() - self.started),
+                    'last_poll': self.last_poll, 'last_error': self.last_error, **self.counters}
+
+
+class RecentSet(object):
+    """Set that only remembers the most recent maxlen items added, forgetting the oldest first"""
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._order = deque()
+        self._items = set()
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def update(self, items):
+        for item in items:
+            if item in self._items:
+                continue
+
+            self._order.append(item)
+            self._items.add(item)
+
+            if len(self._order) > self.maxlen:
+                self._items.discard(self._order.popleft())
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_health_server(metrics: WatchMetrics, port: int) -> HTTPServer:
+    """
+    Serves /health (JSON, 503 once polling has stalled) and /metrics (Prometheus text format) from a background thread.
+    """
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            snapshot = metrics.snapshot()
+
+            if self.path.startswith('/health'):
+                body = json.dumps(snapshot).encode()
+                status = 200 if snapshot['status'] == 'ok' else 503
+                content_type = 'application/json'
+            elif self.path.startswith('/metrics'):
+                body = ''.join(f'secparse_{name}_total {snapshot[name]}\n' for name in metrics.counters)
+                body += f'secparse_uptime_seconds {snapshot["uptime_seconds"]}\n'
+                body += f'secparse_last_poll_timestamp {snapshot["last_poll"] or 0}\n'
+                body = body.encode()
+                status = 200
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # keep request logging out of the daemon's output
+
+    server = _ThreadingHTTPServer(('127.0.0.1', port), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
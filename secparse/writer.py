@@ -0,0 +1,326 @@
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import Counter
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional
+
+from sqlalchemy import create_engine, and_, bindparam, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .config import *
+
+# A write batch is a list of ops, each (kind, table name, rows, key columns) -- plain values, so batches can be sent
+# to the writer service from another process. Every row of an op must have the same columns.
+#   insert / insert_or_ignore -- rows to add
+#   upsert -- rows to add, or to overwrite the given columns of where the primary key already exists
+#   add -- as upsert, but the given columns are added to those of an existing row (e.g. counts)
+#   update -- rows of new values for the row matching their key columns
+#   delete -- rows of key columns to delete by -- with no key columns, a single empty row clears the table
+OP_KINDS = ('insert', 'insert_or_ignore', 'upsert', 'add', 'update', 'delete')
+
+
+class WriteError(SQLAlchemyError):
+    """
+    A write batch that couldn't be committed -- nothing in it was written. A SQLAlchemyError, so it's handled wherever
+    a failed session write is
+    """
+
+
+def write_op(kind, table_name, rows, keys=()) -> tuple:
+    if kind not in OP_KINDS:
+        raise ValueError(f'Unknown write op: {kind}')
+    return kind, table_name, list(rows), tuple(keys)
+
+
+def _statement(table, kind, columns, keys):
+    if kind == 'insert':
+        return table.insert(), {}
+    if kind == 'insert_or_ignore':
+        return table.insert().prefix_with('OR IGNORE'), {}
+
+    if kind in ('upsert', 'add'):
+        primary_key = [c.name for c in table.primary_key.columns]
+        new_value = '{c} + excluded.{c}' if kind == 'add' else 'excluded.{c}'
+        updates = ', '.join(f'{c} = ' + new_value.format(c=c) for c in columns if c not in primary_key)
+        sql = (f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)}) "
+               f"ON CONFLICT ({', '.join(primary_key)}) DO ")
+        return text(sql + (f'UPDATE SET {updates}' if updates else 'NOTHING')), {}
+
+    if kind == 'delete' and not keys:
+        return table.delete(), {}
+
+    # bind names can't clash with column names in an UPDATE, so keys and new values are renamed
+    key_match = and_(*[table.c[key] == bindparam('key_' + key) for key in keys])
+    renames = {key: 'key_' + key for key in keys}
+
+    if kind == 'update':
+        values = {c: bindparam('new_' + c) for c in columns if c not in keys}
+        renames.update({c: 'new_' + c for c in values})
+        return table.update().where(key_match).values(values), renames
+
+    return table.delete().where(key_match), renames
+
+
+def apply_ops(conn, metadata, ops) -> int:
+    """Executes a write batch on a connection (inside the caller's transaction). Returns rows affected"""
+    affected = 0
+
+    for kind, table_name, rows, keys in ops:
+        if not rows:
+            continue
+
+        statement, renames = _statement(metadata.tables[table_name], kind, list(rows[0]), keys)
+        params = [{renames.get(c, c): v for c, v in row.items()} for row in rows] if renames else rows
+
+        result = conn.execute(statement, params)
+        affected += max(result.rowcount, 0)
+
+    return affected
+
+
+def _error_message(err) -> str:
+    if isinstance(err, SQLAlchemyError):
+        return str(err.orig if hasattr(err, 'orig') else err)
+    return f'{type(err).__name__}: {err}'
+
+
+class _Ticket(object):
+    """A submitted write batch, and the acknowledgement its submitter waits on"""
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.affected = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, affected=None, error=None):
+        self.affected = affected
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=WRITER_WAIT_SECONDS) -> int:
+        if not self._done.wait(timeout):
+            raise WriteError(f'no acknowledgement from the writer after {timeout} seconds')
+        if self.error is not None:
+            raise WriteError(self.error)
+        return self.affected
+
+
+class GroupCommitWriter(object):
+    """
+    Owns the only write connection to a SQLite database. Batches submitted from any thread are queued, and whatever
+    has queued up while the previous commit ran goes into the next transaction together -- a group commit -- so
+    concurrent writers share one fsync instead of taking turns holding the write lock.
+
+    A submitter's latency is bounded by the commit in progress plus its own (and max_delay, if set). If a group fails,
+    its batches are retried one per transaction so one bad batch can't fail the others.
+    """
+
+    def __init__(self, db_loc, metadata, max_group=WRITER_MAX_GROUP, max_delay=WRITER_MAX_DELAY_SECONDS):
+        self.metadata = metadata
+        self.max_group = max_group
+        self.max_delay = max_delay
+        self.stats = Counter()
+
+        self.engine = create_engine(f'sqlite:///{db_loc}', echo=False, connect_args={'timeout': SQLITE_BUSY_SECONDS})
+        self.engine.execute('PRAGMA journal_mode = WAL')  # readers don't block the writer, nor it them
+
+        self._pending = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, ops) -> int:
+        """Queues a write batch and waits for it to be committed. Returns rows affected"""
+        if self.broken:
+            raise WriteError('writer has been closed')
+
+        ticket = _Ticket(ops)
+        self._pending.put(ticket)
+        return ticket.wait()
+
+    @property
+    def broken(self) -> bool:
+        """Closed, or its thread has died -- get_writer starts a new writer in its place"""
+        return self._closed or not self._thread.is_alive()
+
+    def close(self):
+        """Commits anything still queued, then stops the writer thread and closes its connection"""
+        self._closed = True
+        self._pending.put(None)
+        self._thread.join()
+        self.engine.dispose()
+
+    def _next_group(self) -> (List[_Ticket], bool):
+        group = [self._pending.get()]
+        if group[0] is None:
+            return [], True
+
+        deadline = time.monotonic() + self.max_delay
+
+        while len(group) < self.max_group:
+            try:
+                ticket = self._pending.get(timeout=max(deadline - time.monotonic(), 0)) if self.max_delay \
+                    else self._pending.get_nowait()
+            except queue.Empty:
+                break
+
+            if ticket is None:
+                return group, True
+            group.append(ticket)
+
+        return group, False
+
+    def _run(self):
+        with self.engine.connect() as conn:
+            stopping = False
+
+            while not stopping:
+                group, stopping = self._next_group()
+                if group:
+                    self._commit(conn, group)
+
+    def _commit(self, conn, group):
+        # any exception is a failed batch rather than the end of the thread -- e.g. a KeyError from a batch naming a
+        # table or column this process's schema doesn't have -- so no submitter is left waiting on a dead writer
+        try:
+            with conn.begin():
+                affected = [apply_ops(conn, self.metadata, ticket.ops) for ticket in group]
+        except Exception:
+            for ticket in group:
+                try:
+                    with conn.begin():
+                        affected = apply_ops(conn, self.metadata, ticket.ops)
+                    ticket.finish(affected)
+                    self.stats.update(commits=1, batches=1, rows=affected)
+                except Exception as err:
+                    ticket.finish(error=_error_message(err))
+                    self.stats['failed_batches'] += 1
+            return
+
+        for ticket, ticket_affected in zip(group, affected):
+            ticket.finish(ticket_affected)
+
+        self.stats['commits'] += 1
+        self.stats['batches'] += len(group)
+        self.stats['rows'] += sum(affected)
+
+
+class WriterServer(object):
+    """
+    Serves a GroupCommitWriter to other processes (`secparse writer`). Each client connection gets a thread that
+    passes its batches to the writer and sends back ('ok', rows affected) or ('error', message).
+
+    Clients authenticate with a random key written to WRITER_KEY_FILE, readable only by this user.
+    """
+
+    def __init__(self, writer: GroupCommitWriter, address=WRITER_ADDRESS):
+        self.writer = writer
+        self.authkey = secrets.token_bytes(32)
+        self.listener = Listener(address, authkey=self.authkey)
+
+        with os.fdopen(os.open(WRITER_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as key_file:
+            key_file.write(self.authkey)
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:  # listener closed
+                break
+            except (AuthenticationError, EOFError):  # a client without the key, or one that hung up
+                continue
+
+            threading.Thread(target=self._serve_client, args=(conn, ), daemon=True).start()
+
+    def _serve_client(self, conn):
+        with conn:
+            while True:
+                try:
+                    ops = conn.recv()
+                except (EOFError, OSError):
+                    break
+
+                try:
+                    conn.send(('ok', self.writer.submit(ops)))
+                except WriteError as err:
+                    conn.send(('error', str(err)))
+
+    def close(self):
+        self.listener.close()
+        if WRITER_KEY_FILE.exists():
+            WRITER_KEY_FILE.unlink()
+        self.writer.close()
+
+
+class WriterClient(object):
+    """Submits write batches to a running `secparse writer` service, with the same submit() as GroupCommitWriter"""
+
+    def __init__(self, address=WRITER_ADDRESS, authkey=None):
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+        self.broken = False
+
+    def submit(self, ops) -> int:
+        with self._lock:
+            if self.broken:
+                raise WriteError('connection to the writer service was lost')
+
+            try:
+                self._conn.send(ops)
+                if not self._conn.poll(WRITER_WAIT_SECONDS):
+                    raise TimeoutError(f'no acknowledgement after {WRITER_WAIT_SECONDS} seconds')
+                status, result = self._conn.recv()
+
+            except (EOFError, OSError) as err:
+                # the service has gone (or a late reply would be read as the next batch's) -- get_writer reconnects
+                self.broken = True
+                self._conn.close()
+                raise WriteError(f'writer service connection failed ({type(err).__name__}: {err}) -- the batch may '
+                                 f'or may not have been committed')
+
+        if status == 'error':
+            raise WriteError(result)
+        return result
+
+    def close(self):
+        self._conn.close()
+
+
+_writers = {}
+
+
+def get_writer(db_loc, metadata):
+    """
+    The writer for a database, shared by everything in this process: the `secparse writer` service if it's running
+    (main database only), otherwise a GroupCommitWriter thread of this process's own.
+    """
+    key = (str(db_loc), os.getpid())  # a forked process can't share its parent's writer thread or socket
+
+    if key not in _writers or _writers[key].broken:
+        _writers[key] = _connect_service() if Path(db_loc) == DB_FILE_LOC else None
+        _writers[key] = _writers[key] or GroupCommitWriter(db_loc, metadata)
+
+    return _writers[key]
+
+
+def close_writer(db_loc):
+    """Stops this process's writer for a database (e.g. one about to be deleted) -- get_writer starts another"""
+    writer = _writers.pop((str(db_loc), os.getpid()), None)
+
+    if writer is not None:
+        writer.close()
+
+
+def _connect_service() -> Optional[WriterClient]:
+    if not WRITER_KEY_FILE.exists():
+        return None
+
+    try:
+        return WriterClient(WRITER_ADDRESS, WRITER_KEY_FILE.read_bytes())
+    except (OSError, EOFError, AuthenticationError):  # key file left behind by a service that's no longer running
+        return None
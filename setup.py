@@ -21,5 +21,6 @@ setup(
         'numpy',
         'sqlalchemy',
     ],
+    extras_require={'analytics': ['duckdb>=0.10']},
     entry_points={'console_scripts': ['secparse=secparse.sec_parse:cli'], },
 )